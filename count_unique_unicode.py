@@ -29,7 +29,8 @@ def generate_translate_file(translate_filename, inp_filename, inp2_filename=None
 
     with open(translate_filename, 'wb') as f:
         f.write(b" 2 2\n")
-        for char in chars_for_translatefile:
+        # Sorted, so the file (and the level cache key made from it) is the same in every process
+        for char in sorted(chars_for_translatefile):
             if not char.isnumeric():
                 f.write(f" {char} \n".encode('utf-8'))
 
@@ -0,0 +1,146 @@
+# Early termination of evaluations whose pattern training is already going badly.
+#
+# Both pattern trainers report (good, bad, missed) on their training wordlist after every
+# level: PatternTrainer.level_counts, and patgen in the pattern.N.log files of
+# make-full-pattern.sh.  sample() hands each of these to a StoppingRule as it appears,
+# which raises EvaluationStopped to abort the rest of the evaluation when
+#
+#   ceiling   after an inhibiting (even) level, the bad ratio is over the one at which
+#             the optimizer's score is 0 even if every other hyphen is good
+#   median    the level score is below the median level score of the completed
+#             evaluations at the same stage, fidelity and level
+#
+# The level score has the shape of PatgenSampler.calculate_score: the good ratio minus
+# the exponential bad penalty.  Levels of completed evaluations are appended to
+# LEVEL_STATS_FILE, which all workers share.
+
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from scipy.optimize import brentq
+
+LEVEL_STATS_FILE = os.environ.get('LEVEL_STATS_FILE', '/var/tmp/ipa-patterns/level-stats.tsv')
+# No stopping before this level; level 1 only ever adds hyphens, so its bad ratio says little.
+MIN_LEVEL = int(os.environ.get('STOPPING_MIN_LEVEL', 2))
+# The median rule only applies once this many evaluations completed the level.
+MEDIAN_MIN_EVALUATIONS = int(os.environ.get('MEDIAN_MIN_EVALUATIONS', 5))
+STOPPING_RULES = ('ceiling', 'median')
+
+_COUNTS = re.compile(r'(\d+) good, (\d+) bad, (\d+) missed')
+
+
+class StoppedEvaluation(NamedTuple):
+    """Where an evaluation was stopped, and the training counts there"""
+    stage: str
+    level: int
+    counts: Tuple[int, int, int]
+    reason: str
+
+
+class EvaluationStopped(Exception):
+    def __init__(self, stopped: StoppedEvaluation):
+        super().__init__(stopped)
+        self.stopped = stopped
+
+    def __str__(self):
+        return f"{self.stopped.stage} level {self.stopped.level}: {self.stopped.reason}"
+
+
+# The counts patgen prints last in a pattern.N.log, i.e. those after its hyphenation pass.
+def read_patgen_counts(log_file: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+            matches = _COUNTS.findall(f.read())
+    except OSError:
+        return None
+    if not matches:
+        return None
+    good, bad, missed = map(int, matches[-1])
+    return good, bad, missed
+
+
+def level_score(counts: Tuple[int, int, int], bad_penalty: float) -> float:
+    good, bad, missed = counts
+    total = max(1, good + bad + missed)
+    return good / total - np.expm1(bad_penalty * bad / total)
+
+
+# Bad ratio b at which good_ratio - (exp(bad_penalty * b) - 1) reaches -1, the 0 of
+# calculate_score, with all the remaining hyphens good (good_ratio = 1 - b).
+def zero_score_bad_ratio(bad_penalty: float) -> float:
+    return brentq(lambda b: (1 - b) - np.expm1(bad_penalty * b) + 1, 0.0, 1.0)
+
+
+# Level scores of completed evaluations by (stage, fidelity, level), by (filename, mtime).
+_level_stats = {}
+
+def load_level_stats(stats_file: str, bad_penalty: float) -> dict:
+    try:
+        st = os.stat(stats_file)
+    except OSError:
+        return {}
+    key = (os.path.abspath(stats_file), st.st_mtime_ns, st.st_size, bad_penalty)
+    if key not in _level_stats:
+        stats = {}
+        with open(stats_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 6:
+                    continue  # torn by a concurrent append
+                stage, fidelity, level, good, bad, missed = fields
+                counts = (int(good), int(bad), int(missed))
+                stats.setdefault((stage, float(fidelity), int(level)), []).append(level_score(counts, bad_penalty))
+        _level_stats.clear()
+        _level_stats[key] = stats
+    return _level_stats[key]
+
+
+class StoppingRule:
+    """Decides after every level of pattern training whether the evaluation goes on"""
+    def __init__(self, rules=STOPPING_RULES, bad_penalty: float = 5.0, stats_file: str = LEVEL_STATS_FILE,
+                 min_level: int = MIN_LEVEL, min_evaluations: int = MEDIAN_MIN_EVALUATIONS):
+        unknown = set(rules) - set(STOPPING_RULES)
+        if unknown:
+            raise ValueError(f"unknown stopping rules {', '.join(sorted(unknown))}, expected {', '.join(STOPPING_RULES)}")
+        self.rules = tuple(rules)
+        self.bad_penalty = bad_penalty
+        self.bad_ratio_ceiling = zero_score_bad_ratio(bad_penalty)
+        self.stats_file = stats_file
+        self.min_level = min_level
+        self.min_evaluations = min_evaluations
+
+    def check(self, stage: str, fidelity: float, level: int, counts: Tuple[int, int, int]):
+        """Raise EvaluationStopped if the evaluation should not go on after this level"""
+        if level < self.min_level:
+            return
+        good, bad, missed = counts
+        bad_ratio = bad / max(1, good + bad + missed)
+        if 'ceiling' in self.rules and level % 2 == 0 and bad_ratio > self.bad_ratio_ceiling:
+            raise EvaluationStopped(StoppedEvaluation(
+                stage, level, counts, f"bad ratio {bad_ratio:.3f} over {self.bad_ratio_ceiling:.3f}"))
+        if 'median' in self.rules:
+            previous = load_level_stats(self.stats_file, self.bad_penalty).get((stage, fidelity, level), [])
+            score = level_score(counts, self.bad_penalty)
+            if len(previous) >= self.min_evaluations and score < np.median(previous):
+                raise EvaluationStopped(StoppedEvaluation(
+                    stage, level, counts, f"level score {score:.3f} under the median {np.median(previous):.3f}"))
+
+    def record(self, fidelity: float, curve: List[Tuple[str, int, Tuple[int, int, int]]]):
+        """Add the (stage, level, counts) of a completed evaluation to the medians"""
+        if not curve or 'median' not in self.rules:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.stats_file)), exist_ok=True)
+        lines = ''.join(f"{stage}\t{fidelity}\t{level}\t{good}\t{bad}\t{missed}\n"
+                        for stage, level, (good, bad, missed) in curve)
+        # A single append, so that concurrent workers do not interleave their lines
+        with open(self.stats_file, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+def make_stopping_rule(spec: str, bad_penalty: float = 5.0) -> Optional[StoppingRule]:
+    """StoppingRule from a comma separated list of STOPPING_RULES, None for 'none' or ''"""
+    rules = [rule.strip() for rule in spec.split(',') if rule.strip()]
+    if not rules or rules == ['none']:
+        return None
+    return StoppingRule(rules, bad_penalty)
@@ -1,21 +1,73 @@
 import subprocess
 import os
+import functools
+import hashlib
+import time
 from shutil import copy
 from itertools import product
 from typing import Tuple, Union, List, Optional
-from validate import validate_using_patgen
-
-TEMP_WORKDIR = '/var/tmp/ipa-patterns/'
+from validate import validate
+from hyph import Hyphenator
+from level_cache import FileCache, cache_key, file_digest
+from sandbox import sandbox
+from early_stopping import StoppingRule
+
+# Results of sample() and the patterns of both stages, by hash of everything they depend on.
+# 0 disables it.
+SAMPLE_CACHE_DIR = os.environ.get('SAMPLE_CACHE_DIR', '/var/tmp/ipa-patterns/sample-cache/')
+SAMPLE_CACHE_MAX_BYTES = int(os.environ.get('SAMPLE_CACHE_MAX_BYTES', 512 << 20))
+sample_cache = FileCache(SAMPLE_CACHE_DIR, SAMPLE_CACHE_MAX_BYTES)
+
+# Target wordlists by (filename, mtime, fidelity); the most recently used ones stay loaded
+# in pool workers between evaluations, enough for the fidelities of successive halving.
+WORDLISTS = 4
+
+@functools.lru_cache(maxsize=WORDLISTS)
+def _read_wordlist(filename: str, mtime: float, fidelity: float) -> List[str]:
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [line for line in f if in_subsample(line, fidelity)]
+
+def load_wordlist(filename: str, fidelity: float = 1.0) -> List[str]:
+    return _read_wordlist(filename, os.path.getmtime(filename), fidelity)
+
+# Parameter files are named relative to parameters/, or absolute for generated ones.
+def params_path(params_file: str) -> str:
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), 'parameters', params_file))
 
 def evaluate_patterns(patterns_filename: str, groundtruth_filename: str, final_training_wordlist: str, 
-                     language: str, params_single_lang: str, workdir: str) -> Tuple[int, int, int]:
+                     language: str, params_single_lang: str, workdir: str, fidelity: float = 1.0,
+                     on_level=None, timings: Optional[dict] = None) -> Tuple[int, int, int]:
     os.makedirs(workdir, exist_ok=True)
-
+    if timings is None:
+        timings = {}
+    start = time.time()
+
+    # The single-language patterns only depend on the joint patterns, the target wordlist
+    # and the parameters, so a cache hit skips straight to validation.
+    with open(patterns_filename, 'rb') as f:
+        patterns_digest = hashlib.sha1(f.read()).hexdigest()
+    single_key = cache_key('single', PATTERN_TRAINER, language, fidelity, patterns_digest,
+                           file_digest(final_training_wordlist, params_path(params_single_lang)))
+    non_ipa_patterns_file = os.path.join(workdir, f"{language}.new.pat")
+    cached = sample_cache.get(single_key)
+    if cached is not None:
+        with open(non_ipa_patterns_file, 'wb') as f:
+            f.write(cached)
+        timings['single'] = time.time() - start
+        start = time.time()
+        good, bad, missed = validate(groundtruth_filename, non_ipa_patterns_file, language)
+        timings['validate'] = time.time() - start
+        return good, bad, missed
+
+    # Hyphenate the target wordlist in-process; the freshly generated patterns
+    # are used once, so they are compiled in memory rather than cached on disk.
     hyphenated_ipa_file = os.path.join(workdir, f"{language}.ipa.new.wlh")
-    subprocess.run(["python3", "hyph.py", patterns_filename, final_training_wordlist], stdout=open(hyphenated_ipa_file, "w"))
+    hyphenator = Hyphenator(patterns_filename, cache=False)
+    with open(hyphenated_ipa_file, 'w', encoding='utf-8') as f:
+        f.write(hyphenator.hyphenate_lines(load_wordlist(final_training_wordlist, fidelity)))
 
     # Convert the hyphenated wordlist from IPA
-    hyphenated_file = os.path.join(TEMP_WORKDIR, f"{language}.new.wlh")
+    hyphenated_file = os.path.join(workdir, f"{language}.new.wlh")
     run_if_needed(
         ["wlh2ipawlh/target/release/ipawlh2wlh", hyphenated_ipa_file, hyphenated_file],
         hyphenated_ipa_file,
@@ -24,11 +76,18 @@ def evaluate_patterns(patterns_filename: str, groundtruth_filename: str, final_t
     )
 
     # Generate single-language non-IPA patterns
-    non_ipa_patterns_file = os.path.join(TEMP_WORKDIR, f"{language}.new.pat")
-    generate_non_ipa_patterns(hyphenated_file, non_ipa_patterns_file, language, params_single_lang)
-
+    if os.path.exists(non_ipa_patterns_file):
+        os.remove(non_ipa_patterns_file)  # so that a failed run is not cached
+    generate_non_ipa_patterns(hyphenated_file, non_ipa_patterns_file, language, params_single_lang, workdir, on_level)
+    if os.path.exists(non_ipa_patterns_file):
+        with open(non_ipa_patterns_file, 'rb') as f:
+            sample_cache.put(single_key, f.read())
+
+    timings['single'] = time.time() - start
+    start = time.time()
     #print(f"Patterns generated for {language} in {non_ipa_patterns_file}. Evaluation:")
-    good, bad, missed = validate_using_patgen(groundtruth_filename, non_ipa_patterns_file, language)
+    good, bad, missed = validate(groundtruth_filename, non_ipa_patterns_file, language)
+    timings['validate'] = time.time() - start
     #print(f"{good} good, {bad} bad, {missed} missed")
     return good, bad, missed
 
@@ -41,35 +100,45 @@ def get_groundtruth_for(language: str):
     else:
         return f'groundtruth/{language}-wiktionary.wlh'
 
+def get_target_wordlist_for(language: str):
+    return f'work/{language}.ipa.wls'
+
+# Digest of everything an evaluation reads besides its parameters; evaluations are only
+# comparable under the same one.
+def corpus_digest(ipa_files: List[str], language: str) -> str:
+    return cache_key(file_digest(*ipa_files),
+                     file_digest(get_target_wordlist_for(language), get_groundtruth_for(language)))
+
 from count_unique_unicode import generate_translate_file
+from generate_joint_patterns import PATTERN_TRAINER, in_subsample
+from pypatgen import Dictionary, Translate, read_parameters
+from level_cache import make_full_pattern, train_cached
 
 
 # expects input file to be absolute path
-def generate_non_ipa_patterns(input_file: str, output_file: str, language: str, params_single_lang: str):
+def generate_non_ipa_patterns(input_file: str, output_file: str, language: str, params_single_lang: str,
+                              workdir: str, on_level=None):
+    params_file = params_path(params_single_lang)
+    if PATTERN_TRAINER == 'python':
+        # generate_translate_file lists every letter of the input, with hyphen mins 2 2.
+        train_cached(Dictionary.from_file(input_file), Translate(2, 2, None), read_parameters(params_file),
+                     on_level=on_level).write(output_file)
+        return
+
     # Create a custom translate file
-    translate_file = os.path.join(TEMP_WORKDIR, f"{language}.tra")
+    translate_file = os.path.join(workdir, f"{language}.tra")
     generate_translate_file(translate_file, input_file)
 
-    # Generate patterns using patgen
-    params_file = os.path.abspath(os.path.join(os.path.dirname(__file__), 'parameters', params_single_lang))
+    # Generate patterns using patgen, starting from the deepest cached level
+    make_full_pattern(input_file, translate_file, params_file, workdir, on_level=on_level, stdout=subprocess.DEVNULL)
 
-    make_full_pattern_script = os.path.abspath(os.path.join(os.path.dirname(__file__), 'make-full-pattern.sh'))
-
-    subprocess.run([
-        "bash",
-        make_full_pattern_script,
-        input_file,
-        translate_file,
-        params_file,
-    ], cwd=TEMP_WORKDIR, stdout=subprocess.DEVNULL)
-
-    pattern_final = os.path.join(TEMP_WORKDIR, "pattern.final")
+    pattern_final = os.path.join(workdir, "pattern.final")
     if os.path.exists(pattern_final):
         copy(pattern_final, output_file)
     else:
         print(f"Error: pattern.final was not generated for {language}")
 
-    #pattmp_4 = os.path.join(TEMP_WORKDIR, "pattmp.4")
+    #pattmp_4 = os.path.join(workdir, "pattmp.4")
 
 
 def run_if_needed(cmd, source_file, target_file, description):
@@ -134,18 +203,27 @@ def create_temp_param_file(params_tuple: Tuple[int, ...], base_param_file: str,
 
 from generate_joint_patterns import generate_joint_patterns
 
-def get_temp_workdir(language: str, workdir_i: Optional[int] = None) -> str:
-    """Get a unique temporary working directory for this process"""
-    base_dir = '/var/tmp/ipa-patterns/'
-    return os.path.join(base_dir, f"{language}{workdir_i or ''}/")
-
+# fidelity < 1 is a cheaper, rougher evaluation: both pattern stages are trained on a fixed
+# subsample of that fraction of the IPA corpora and the target wordlist. The ground truth
+# is always used in full, so counts of different fidelities are comparable.
+# With a stopping rule, the training counts of every level of both stages go to stopping.check,
+# which raises early_stopping.EvaluationStopped to abort the evaluation.
+# timings, if given, gets the seconds spent on the 'joint', 'single' and 'validate' stages.
 def sample(ipa_files: List[str], weights: Tuple[int, ...], params_ipa: Union[str, Tuple[int, ...]], 
-          params_single: Union[str, Tuple[int, ...]], threshold: int, language: str, workdir_i: Optional[int] = None) -> Tuple[int, int, int]:
-    # Get unique workdir for this process
-    temp_workdir = get_temp_workdir(language, workdir_i)
-    os.makedirs(temp_workdir, exist_ok=True)
-    
-    output_file = "work/all.pat"
+          params_single: Union[str, Tuple[int, ...]], threshold: int, language: str, workdir_i: Optional[int] = None,
+          fidelity: float = 1.0, stopping: Optional[StoppingRule] = None,
+          timings: Optional[dict] = None) -> Tuple[int, int, int]:
+    # Every evaluation gets its own sandbox, so any number of them can run at once;
+    # workdir_i only makes it easier to tell them apart.
+    with sandbox(f"{language}{'' if workdir_i is None else workdir_i}-") as temp_workdir:
+        return sample_in(temp_workdir, ipa_files, weights, params_ipa, params_single, threshold, language, fidelity,
+                         stopping, timings)
+
+def sample_in(temp_workdir: str, ipa_files: List[str], weights: Tuple[int, ...], params_ipa: Union[str, Tuple[int, ...]],
+              params_single: Union[str, Tuple[int, ...]], threshold: int, language: str,
+              fidelity: float = 1.0, stopping: Optional[StoppingRule] = None,
+              timings: Optional[dict] = None) -> Tuple[int, int, int]:
+    output_file = os.path.join(temp_workdir, "all.pat")
 
     # Pass workdir to functions that need it
     actual_params_ipa = (create_temp_param_file(params_ipa, 'csskhyphen.par', threshold, temp_workdir)
@@ -153,10 +231,51 @@ def sample(ipa_files: List[str], weights: Tuple[int, ...], params_ipa: Union[str
     actual_params_single = (create_temp_param_file(params_single, 'csskhyphen.par', threshold, temp_workdir)
                           if isinstance(params_single, tuple) else params_single)
 
-    generate_joint_patterns(ipa_files, list(weights), output_file, actual_params_ipa, temp_workdir)
-    
-    return evaluate_patterns(output_file, get_groundtruth_for(language), 
-                           f'work/{language}.ipa.wls', language, actual_params_single, temp_workdir)
+    groundtruth = get_groundtruth_for(language)
+    target_wordlist = get_target_wordlist_for(language)
+    joint_key = cache_key('joint', PATTERN_TRAINER, fidelity, file_digest(*ipa_files), [int(w) for w in weights],
+                          file_digest(params_path(actual_params_ipa)))
+    result_key = cache_key('result', joint_key, language, file_digest(target_wordlist, groundtruth),
+                           file_digest(params_path(actual_params_single)))
+    cached = sample_cache.get(result_key)
+    if cached is not None:
+        good, bad, missed = map(int, cached.split())
+        return good, bad, missed
+
+    # (stage, level, counts) of the levels trained by this evaluation
+    curve = []
+    def level_monitor(stage):
+        if stopping is None:
+            return None
+        def on_level(level, counts):
+            curve.append((stage, level, counts))
+            stopping.check(stage, fidelity, level, counts)
+        return on_level
+
+    if timings is None:
+        timings = {}
+    start = time.time()
+    cached = sample_cache.get(joint_key)
+    if cached is not None:
+        with open(output_file, 'wb') as f:
+            f.write(cached)
+    else:
+        if os.path.exists(output_file):
+            os.remove(output_file)  # so that a failed run is not cached
+        generate_joint_patterns(ipa_files, list(weights), output_file, actual_params_ipa, temp_workdir, fidelity,
+                                level_monitor('joint'))
+        if os.path.exists(output_file):
+            with open(output_file, 'rb') as f:
+                sample_cache.put(joint_key, f.read())
+    timings['joint'] = time.time() - start
+
+    good, bad, missed = evaluate_patterns(output_file, groundtruth, target_wordlist,
+                                          language, actual_params_single, temp_workdir, fidelity,
+                                          level_monitor(language), timings)
+    sample_cache.put(result_key, f"{good} {bad} {missed}".encode())
+    if stopping is not None:
+        stopping.record(fidelity, curve)
+    return good, bad, missed
 
 def run_with_params(params_ipa, params_single):
     ipa_files = ["work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/ru.ipa.wlh"]
@@ -183,7 +302,7 @@ def run_with_params(params_ipa, params_single):
     }
 
     if os.path.exists("work/hyph-uk.tex"):
-        (g, b, m) = validate_using_patgen("groundtruth/uk-full-wiktionary.wlh", "work/hyph-uk.tex", "uk")
+        (g, b, m) = validate("groundtruth/uk-full-wiktionary.wlh", "work/hyph-uk.tex", "uk")
         json_report["validation_results"] = [ (g, b, m)]
 
     # Save results to a JSON file
@@ -197,8 +316,8 @@ if __name__ == "__main__":
     print("Best results (good, bad, missed) for Polish from thesis:")
     print(sample(["work/cs.ipa.wlh", "work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/ru.ipa.wlh"], (8,1,1,5), (8,5,5,5), (8,4,8,4), 3, 'pl'))
     print("Results from original Polish patterns")
-    print(validate_using_patgen("groundtruth/pl-wiktionary.wlh", "work/hyph-pl.tex", 'pl'))
+    print(validate("groundtruth/pl-wiktionary.wlh", "work/hyph-pl.tex", 'pl'))
     print("Best results (good, bad, missed) for Ukrainian from thesis:")
     print(sample(["work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/ru.ipa.wlh"], (0,8,0,5), (7,8,6,1), (5,4,8,4), 3, 'uk'))
     print("Results from original Ukrainian patterns")
-    print(validate_using_patgen("groundtruth/uk-full-wiktionary.wlh", "work/hyph-uk.tex", 'uk'))
\ No newline at end of file
+    print(validate("groundtruth/uk-full-wiktionary.wlh", "work/hyph-uk.tex", 'uk'))
\ No newline at end of file
@@ -0,0 +1,171 @@
+# Every finished evaluation of the optimizer, in a SQLite database.
+#
+# Pool workers commit their evaluation as soon as it is finished, so a crash loses
+# nothing, and any number of optimizer processes can share the database (WAL mode).
+# Rows hold the raw counts (NULL for evaluations stopped early), not just the score,
+# so they stay usable when the scoring changes.
+#
+# Samplers remember the id of the last row they have taken in; on restart they only
+# read the rows added since, see PatgenSampler.sync.
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from typing import Iterator, NamedTuple, Optional, Tuple
+from early_stopping import StoppedEvaluation
+
+EVALUATION_DB = os.environ.get('EVALUATION_DB', 'work/evaluations.sqlite')
+# Seconds to wait for another process's write transaction
+BUSY_TIMEOUT = 60
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY,
+    language TEXT NOT NULL,
+    corpus TEXT NOT NULL,
+    params TEXT NOT NULL,
+    fidelity REAL NOT NULL,
+    weights TEXT NOT NULL,
+    params_ipa TEXT NOT NULL,
+    params_single TEXT NOT NULL,
+    threshold INTEGER NOT NULL,
+    good INTEGER,
+    bad INTEGER,
+    missed INTEGER,
+    stopped TEXT,
+    score REAL,
+    timings TEXT,
+    host TEXT,
+    worker INTEGER,
+    owner TEXT,
+    finished REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS evaluations_params ON evaluations (language, corpus, params, fidelity);
+CREATE INDEX IF NOT EXISTS evaluations_score ON evaluations (language, corpus, score);
+'''
+
+
+def _ints(values) -> str:
+    return ','.join(str(int(v)) for v in values)
+
+def _tuple(text: str) -> Tuple[int, ...]:
+    return tuple(int(v) for v in text.split(','))
+
+def params_key(weights, params_ipa, params_single, threshold) -> str:
+    return f"{_ints(weights)}|{_ints(params_ipa)}|{_ints(params_single)}|{int(threshold)}"
+
+
+class StoredEvaluation(NamedTuple):
+    id: int
+    params: Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...], int]
+    fidelity: float
+    # (good, bad, missed), or where the evaluation was stopped early
+    result: object
+    owner: str
+    # Seconds of the stages of the evaluation, see evaluate_params; None if unknown
+    timings: Optional[dict] = None
+
+
+class EvaluationStore:
+    """Connection to the evaluation database; picklable, each process opens its own connection"""
+    def __init__(self, path: str = EVALUATION_DB, owner: Optional[str] = None):
+        self.path = path
+        # The optimizer process the evaluations are run for
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{int(time.time())}"
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'owner': self.owner}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['owner'])
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def add(self, language: str, corpus: str, params, fidelity: float, result, score: Optional[float],
+            timings: Optional[dict] = None) -> bool:
+        """Commit an evaluation; False if the same one was already stored.  A completed evaluation
+        takes the place of one of the same parameters that was stopped early, as a new row, so
+        that other processes sync it."""
+        weights, params_ipa, params_single, threshold = params
+        if isinstance(result, StoppedEvaluation):
+            counts = (None, None, None)
+            stopped = json.dumps(result._asdict())
+        else:
+            counts = tuple(int(c) for c in result)
+            stopped = None
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row_id = None
+            if stopped is None:
+                # Taken before the delete, since SQLite reuses the largest rowid once it is deleted.
+                row_id, = connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM evaluations').fetchone()
+                connection.execute(
+                    'DELETE FROM evaluations WHERE language = ? AND corpus = ? AND params = ? AND fidelity = ? '
+                    'AND stopped IS NOT NULL', (language, corpus, params_key(*params), float(fidelity)))
+            added = self._insert(language, corpus, params, fidelity, counts, stopped, score, timings, row_id)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return added
+
+    def _insert(self, language, corpus, params, fidelity, counts, stopped, score, timings, row_id=None) -> bool:
+        weights, params_ipa, params_single, threshold = params
+        cursor = self.connection.execute(
+            'INSERT OR IGNORE INTO evaluations (id, language, corpus, params, fidelity, weights, params_ipa, '
+            'params_single, threshold, good, bad, missed, stopped, score, timings, host, worker, owner, finished) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (row_id, language, corpus, params_key(*params), float(fidelity), _ints(weights), _ints(params_ipa),
+             _ints(params_single), int(threshold), *counts, stopped, score,
+             json.dumps(timings) if timings is not None else None,
+             socket.gethostname(), os.getpid(), self.owner, time.time()))
+        return cursor.rowcount > 0
+
+    def lookup(self, language: str, corpus: str, params, fidelity: float = 1.0, completed: bool = False):
+        """(good, bad, missed) or StoppedEvaluation of a stored evaluation, None if there is none,
+        or with completed, if it was stopped early"""
+        row = self.connection.execute(
+            'SELECT good, bad, missed, stopped FROM evaluations '
+            'WHERE language = ? AND corpus = ? AND params = ? AND fidelity = ?',
+            (language, corpus, params_key(*params), float(fidelity))).fetchone()
+        if row is None or (completed and row[3] is not None):
+            return None
+        return self._result(*row)
+
+    @staticmethod
+    def _result(good, bad, missed, stopped):
+        if stopped is not None:
+            fields = json.loads(stopped)
+            fields['counts'] = tuple(fields['counts'])
+            return StoppedEvaluation(**fields)
+        return good, bad, missed
+
+    def since(self, language: str, corpus: str, last_id: int = 0) -> Iterator[StoredEvaluation]:
+        """Evaluations with an id over last_id, in id order"""
+        rows = self.connection.execute(
+            'SELECT id, weights, params_ipa, params_single, threshold, fidelity, good, bad, missed, stopped, owner, '
+            'timings '
+            'FROM evaluations WHERE id > ? AND language = ? AND corpus = ? ORDER BY id',
+            (last_id, language, corpus))
+        for id, weights, params_ipa, params_single, threshold, fidelity, good, bad, missed, stopped, owner, timings in rows:
+            params = (_tuple(weights), _tuple(params_ipa), _tuple(params_single), threshold)
+            yield StoredEvaluation(id, params, fidelity, self._result(good, bad, missed, stopped), owner,
+                                   json.loads(timings) if timings is not None else None)
+
+    def last_id(self) -> int:
+        return self.connection.execute('SELECT COALESCE(MAX(id), 0) FROM evaluations').fetchone()[0]
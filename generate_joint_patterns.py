@@ -1,17 +1,27 @@
 # This script takes a list of .ipa.wlh files and weights and merges them into a single .ipa.wlh file and trains joint patterns on it. Also creates a translate file for the IPA.
 
 import sys
-from os import makedirs
 from collections import OrderedDict
 from typing import List
 import subprocess
 import os
 import shutil
-
-TEMP_WORKDIR_PREFIX = '/var/tmp/ipa-patterns/'
-
-# Create the temporary work directory if it doesn't exist
-makedirs(TEMP_WORKDIR_PREFIX, exist_ok=True)
+import zlib
+from pypatgen import Dictionary, Translate, read_parameters
+from level_cache import make_full_pattern, train_cached
+from sandbox import sandbox
+
+# 'patgen' runs make-full-pattern.sh, 'python' trains in-process with pypatgen, which
+# tests/test_pattern_trainers.py checks against patgen.
+PATTERN_TRAINER = os.environ.get('PATTERN_TRAINER', 'patgen')
+# Seed of the word hash that picks the subsample of a wordlist at a given fidelity
+FIDELITY_SEED = 42
+
+# Whether a wordlist line belongs to the subsample at the given fidelity (fraction of the words).
+# Depends on the word only, so subsamples are the same in every run and nested: a word kept
+# at some fidelity is also kept at every higher one.
+def in_subsample(line: str, fidelity: float) -> bool:
+    return fidelity >= 1.0 or zlib.crc32(line.strip().encode('utf-8'), FIDELITY_SEED) < fidelity * 2**32
 
 def decode_pattern_file(input_file, output_file, inverted_translation_dict):
     with open(input_file, 'rb') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
@@ -54,38 +64,20 @@ def generate_translate_file(translate_filename, inp_filename):
 
     with open(translate_filename, 'wb') as f:
         f.write(b" 1 1\n")
-        for char in chars_for_translatefile:
+        # Sorted, so the file (and the level cache key made from it) is the same in every process
+        for char in sorted(chars_for_translatefile):
             if not char.isnumeric():
                 f.write(f" {char} \n".encode('utf-8'))
 
-def train_joint_patterns(joint_ipa_file, translate_file, params_file, output_file):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    make_full_pattern_script = os.path.join(script_dir, 'make-full-pattern.sh')
-    
-    output_dir = os.path.join(TEMP_WORKDIR_PREFIX, 'out')
+def train_joint_patterns(joint_ipa_file, translate_file, params_file, output_file, workdir, on_level=None):
+    output_dir = os.path.join(workdir, 'out')
     os.makedirs(output_dir, exist_ok=True)
     
-    command = [
-        'bash',
-        make_full_pattern_script,
-        joint_ipa_file,
-        translate_file,
-        params_file
-    ]
-    
     try:
-        process = subprocess.Popen(
-            command,
-            cwd=output_dir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        
-        _, stderr = process.communicate()
-        if process.returncode != 0:
-            sys.stderr.write(stderr.decode('latin1', errors='replace'))
-        
-        return_code = process.wait()
+        result = make_full_pattern(joint_ipa_file, translate_file, params_file, output_dir, on_level=on_level,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            sys.stderr.write(result.stderr.decode('latin1', errors='replace'))
         
         pattern_final = os.path.join(output_dir, 'pattern.final')
         if os.path.exists(pattern_final):
@@ -95,13 +87,43 @@ def train_joint_patterns(joint_ipa_file, translate_file, params_file, output_fil
         else:
             print("Error: pattern.final was not generated", file=sys.stderr)
         
-        if return_code != 0:
-            raise subprocess.CalledProcessError(return_code, command)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args)
     
     except subprocess.CalledProcessError as e:
         print(f"Error running make-full-pattern.sh: {e}", file=sys.stderr)
 
-def merge_ipa_files(ipa_filenames, weights: List[int], output_filename: str):
+# Lines merge_ipa_files drops: espeak sometimes puts (en) tags in and tries to be smart.
+def keep_ipa_line(line: str) -> bool:
+    return '(' not in line and '^' not in line and '?' not in line and '"' not in line
+
+# Parsed .ipa.wlh files by (filename, mtime, fidelity); they stay loaded in pool workers between evaluations.
+_ipa_dictionaries = {}
+
+def load_ipa_dictionary(ipa_filename: str, fidelity: float = 1.0) -> Dictionary:
+    key = (os.path.abspath(ipa_filename), os.path.getmtime(ipa_filename), fidelity)
+    if key not in _ipa_dictionaries:
+        with open(ipa_filename, 'r', encoding='utf-8') as f:
+            _ipa_dictionaries[key] = Dictionary.from_lines(
+                line for line in f if keep_ipa_line(line) and in_subsample(line, fidelity))
+    return _ipa_dictionaries[key]
+
+# Same patterns as merge_ipa_files + train_joint_patterns, without writing the joint wordlist.
+def train_joint_patterns_in_memory(ipa_filenames, weights: List[int], params_file, output_file, fidelity: float = 1.0,
+                                   on_level=None):
+    parts = []
+    for ipa_filename, weight in zip(ipa_filenames, weights):
+        if weight == 0:
+            continue
+        try:
+            parts.append((load_ipa_dictionary(ipa_filename, fidelity), weight))
+        except FileNotFoundError:
+            print(f"File not found: {ipa_filename}")
+    # generate_translate_file lists every letter of the joint wordlist, with hyphen mins 1 1.
+    train_cached(Dictionary.concat(parts), Translate(1, 1, None), read_parameters(params_file),
+                 on_level=on_level).write(output_file)
+
+def merge_ipa_files(ipa_filenames, weights: List[int], output_filename: str, fidelity: float = 1.0):
     with open(output_filename, 'w', encoding='utf-8') as output_file:
         for ipa_filename, weight in zip(ipa_filenames, weights):
             if weight == 0:
@@ -110,7 +132,7 @@ def merge_ipa_files(ipa_filenames, weights: List[int], output_filename: str):
                 with open(ipa_filename, 'r', encoding='utf-8') as input_file:
                     output_file.write(f"{weight}\n")
                     for line in input_file:
-                        if '(' not in line and '^' not in line and '?' not in line and '"' not in line:  # espeak sometimes put (en) tags in and tries to be smart
+                        if keep_ipa_line(line) and in_subsample(line, fidelity):
                                 output_file.write(f"{line.strip()}\n")
                 output_file.write('\n')  # Add a newline between files
             except FileNotFoundError:
@@ -118,32 +140,38 @@ def merge_ipa_files(ipa_filenames, weights: List[int], output_filename: str):
             except Exception as e:
                 print(f"An error occurred while processing {ipa_filename}: {e}")
 
-def generate_joint_patterns(ipa_filenames, weights, output_filename, params_filename, WORKDIR):
-    global TEMP_WORKDIR_PREFIX
-    TEMP_WORKDIR_PREFIX = WORKDIR
-    # Merge the .ipa.wlh files into a single .ipa.wlh file
-    joint_ipa_file = TEMP_WORKDIR_PREFIX + 'joint.ipa.wlh'
-    translate_filename = TEMP_WORKDIR_PREFIX + 'joint.tra'
+# fidelity < 1 trains on a fixed subsample of that fraction of every input's words, see in_subsample.
+# on_level gets the training counts after every level, see level_cache.LevelCallback.
+def generate_joint_patterns(ipa_filenames, weights, output_filename, params_filename, workdir, fidelity: float = 1.0,
+                            on_level=None):
     assert(len(ipa_filenames) == len(weights))
-    merge_ipa_files(ipa_filenames, weights, joint_ipa_file)
+    params_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parameters', params_filename)
+    if PATTERN_TRAINER == 'python':
+        train_joint_patterns_in_memory(ipa_filenames, weights, params_file, output_filename, fidelity, on_level)
+        return
+
+    # Merge the .ipa.wlh files into a single .ipa.wlh file
+    joint_ipa_file = os.path.join(workdir, 'joint.ipa.wlh')
+    translate_filename = os.path.join(workdir, 'joint.tra')
+    merge_ipa_files(ipa_filenames, weights, joint_ipa_file, fidelity)
     
     generate_translate_file(translate_filename, joint_ipa_file)
 
-    params_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parameters', params_filename)
-    train_joint_patterns(joint_ipa_file, translate_filename, params_file, output_filename)
+    train_joint_patterns(joint_ipa_file, translate_filename, params_file, output_filename, workdir, on_level)
 
 if __name__ == "__main__":
     ipa_files = ["work/cs.ipa.wlh"]#, "work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/sh.ipa.wlh"]
     weights = [2]#[9, 1, 1, 1, 1]
     output_file = "work/all.pat"
     
-    generate_joint_patterns(ipa_files, weights, output_file, 'ipa-sojka-correctoptimized.par')
-
-    # Check if pattmp.4 exists in patgen working directory
-    patgen_pattmp4 = os.path.join(TEMP_WORKDIR_PREFIX, 'out/pattmp.4')
-    if os.path.exists(patgen_pattmp4):
-        # Define the target file in the main working directory
-        main_pattmp4 = os.path.join('work', 'pattmp.4')
-        shutil.copy(patgen_pattmp4, main_pattmp4)
-        print(f"pattmp.4 saved to: {main_pattmp4}")
+    with sandbox('joint-') as workdir:
+        generate_joint_patterns(ipa_files, weights, output_file, 'ipa-sojka-correctoptimized.par', workdir)
+
+        # Check if pattmp.4 exists in patgen working directory
+        patgen_pattmp4 = os.path.join(workdir, 'out/pattmp.4')
+        if os.path.exists(patgen_pattmp4):
+            # Define the target file in the main working directory
+            main_pattmp4 = os.path.join('work', 'pattmp.4')
+            shutil.copy(patgen_pattmp4, main_pattmp4)
+            print(f"pattmp.4 saved to: {main_pattmp4}")
     print(f"Joint IPA patterns saved to: {output_file}")
\ No newline at end of file
@@ -1,31 +1,155 @@
 # Adapted from https://nedbatchelder.com/code/modules/hyphenate.py
 # Adjusted minimum length to 4
 
+import argparse
 import re
 import regex
 import sys
+from itertools import islice
+from multiprocessing import Pool
+
+from pattern_trie import CompiledTrie, load_cached
+
+ENGINES = ('trie', 'aho-corasick')
+
+# Words per block in hyphenate_many; blocks are padded to their longest word.
+BATCH_SIZE = 4096
+# Input lines per chunk handed to a worker by the CLI, and its output buffer size.
+CHUNK_LINES = 20000
+OUTPUT_BUFFER = 1 << 20
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton over the pattern trie.
+
+    States are the trie nodes.  Every state carries the point vector of all
+    patterns that are suffixes of its string, merged with max and aligned to
+    the end of the match, so one left-to-right pass finds every pattern.
+    """
+    def __init__(self, trie):
+        self.trie = trie
+        n = trie.n_nodes
+        self.fail = [0] * n
+        # outputs[s] is None or (shift, values): values apply to points[j + shift:]
+        # after reading work[j] into state s.
+        self.outputs = [None] * n
+        depth = [0] * n
+        merged = [None] * n
+
+        # Trie nodes are numbered breadth-first, so parents and failure
+        # targets are always finished before their children.
+        for s in range(n):
+            own = trie.points(s)
+            f = self.fail[s]
+            if s == 0 or (own is None and merged[f] is None):
+                vec = None
+            else:
+                vec = list(own) if own is not None else [0] * (depth[s] + 1)
+                if merged[f] is not None:
+                    shift = depth[s] - depth[f]
+                    for k, v in enumerate(merged[f]):
+                        if v > vec[shift + k]:
+                            vec[shift + k] = v
+            merged[s] = vec
+            if vec is not None:
+                lead = 0
+                while lead < len(vec) and vec[lead] == 0:
+                    lead += 1
+                end = len(vec)
+                while end > lead and vec[end - 1] == 0:
+                    end -= 1
+                if end > lead:
+                    self.outputs[s] = (lead - depth[s] + 1, tuple(vec[lead:end]))
+
+            for c, child in trie.children(s).items():
+                depth[child] = depth[s] + 1
+                if s != 0:
+                    self.fail[child] = self._step(self.fail[s], c)
+
+    def _step(self, s, c):
+        children = self.trie.children
+        while True:
+            nxt = children(s).get(c)
+            if nxt is not None:
+                return nxt
+            if s == 0:
+                return 0
+            s = self.fail[s]
+
+    def points(self, work):
+        points = [0] * (len(work)+1)
+        children = self.trie.children
+        fail = self.fail
+        outputs = self.outputs
+        s = 0
+        for j, c in enumerate(work):
+            while True:
+                nxt = children(s).get(c)
+                if nxt is not None:
+                    s = nxt
+                    break
+                if s == 0:
+                    break
+                s = fail[s]
+            out = outputs[s]
+            if out is not None:
+                base = j + out[0]
+                for k, v in enumerate(out[1]):
+                    if v > points[base+k]:
+                        points[base+k] = v
+        return points
+
 
 class Hyphenator:
-    def __init__(self, tex_file):
-        self.tree = {}
+    def __init__(self, tex_file, cache=True, engine='trie'):
         self.exceptions = {}
-        self.load_patterns_from_tex(tex_file)
+        self.load_patterns_from_tex(tex_file, cache)
+        self._select_engine(engine)
+
+    @classmethod
+    def from_patterns(cls, patterns, engine='trie'):
+        """Build a Hyphenator from a list of patterns like 'a1bc3d4'"""
+        hyphenator = cls.__new__(cls)
+        hyphenator.exceptions = {}
+        tree = {}
+        for pattern in patterns:
+            hyphenator._insert_pattern(tree, pattern)
+        hyphenator.trie = CompiledTrie.from_tree(tree)
+        hyphenator._select_engine(engine)
+        return hyphenator
 
-    def load_patterns_from_tex(self, tex_file):
-        with open(tex_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+    def _select_engine(self, engine):
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, got {engine!r}")
+        if engine == 'aho-corasick':
+            self._word_points = AhoCorasick(self.trie).points
+        else:
+            self._word_points = self._trie_points
+
+    def load_patterns_from_tex(self, tex_file, cache=True):
+        # With cache, the compiled trie is memory-mapped from a file next to
+        # tex_file and only re-parsed when the patterns change.
+        if cache:
+            self.trie = load_cached(tex_file, self._build_tree)
+        else:
+            with open(tex_file, 'r', encoding='utf-8') as f:
+                self.trie = CompiledTrie.from_tree(self._build_tree(f.read()))
+
+    def _build_tree(self, text):
         patterns = []
-        for line in lines:
+        for line in text.split('\n'):
             line = line.strip()
             if line.startswith('%') or line.startswith('}'):
                 continue
             if line.startswith('\\patterns{'):
                 line = line[10:]
             patterns.extend(line.split())
+        tree = {}
         for pattern in patterns:
-            self._insert_pattern(pattern)
+            self._insert_pattern(tree, pattern)
+        return tree
 
-    def _insert_pattern(self, pattern):
+    def _insert_pattern(self, tree, pattern):
         # Convert the a pattern like 'a1bc3d4' into a string of chars 'abcd'
         # and a list of points [ 0, 1, 0, 3, 4 ].
         chars = re.sub(r'[0-9]', '', pattern)
@@ -34,32 +158,35 @@ class Hyphenator:
         # Insert the pattern into the tree.  Each character finds a dict
         # another level down in the tree, and leaf nodes have the list of
         # points.
-        t = self.tree
+        t = tree
         for c in chars:
             if c not in t:
                 t[c] = {}
             t = t[c]
         t[None] = points
 
+    def _trie_points(self, work):
+        points = [0] * (len(work)+1)
+        trie = self.trie
+        for i in range(len(work)):
+            node = 0
+            for c in work[i:]:
+                node = trie.children(node).get(c)
+                if node is None:
+                    break
+                p = trie.points(node)
+                if p is not None:
+                    for j in range(len(p)):
+                        points[i+j] = max(points[i+j], p[j])
+        return points
+
     def hyphenate_word(self, word):
         if len(word) <= 2:
             return [word]
         if word.lower() in self.exceptions:
             points = self.exceptions[word.lower()]
         else:
-            work = '.' + word.lower() + '.'
-            points = [0] * (len(work)+1)
-            for i in range(len(work)):
-                t = self.tree
-                for c in work[i:]:
-                    if c in t:
-                        t = t[c]
-                        if None in t:
-                            p = t[None]
-                            for j in range(len(p)):
-                                points[i+j] = max(points[i+j], p[j])
-                    else:
-                        break
+            points = self._word_points('.' + word.lower() + '.')
             points[1] = points[2] = points[-2] = points[-3] = 0
         pieces = ['']
         for c, p in zip(word, points[2:]):
@@ -68,21 +195,211 @@ class Hyphenator:
                 pieces.append('')
         return pieces
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python hyph.py <patterns_file.tex> <text_file.txt>")
-        sys.exit(1)
+    def hyphenate_lines(self, lines):
+        """Hyphenate lines of whitespace-separated words into one block of text"""
+        split = [line.split() for line in lines]
+        hyphenated = iter(self.hyphenate_many([w for words in split for w in words]))
+        return ''.join(' '.join(next(hyphenated) for _ in words) + '\n' for words in split)
+
+    def hyphenate_many(self, words, masks=False):
+        """Hyphenate a whole wordlist at once, with the same result as hyphenate_word.
+
+        Returns the words in .wlh form ('-' between pieces), or with masks=True
+        integer bitmasks where bit k is set if there is a hyphen after word[k].
+        """
+        import numpy as np
+
+        words = list(words)
+        hyphens = self.hyphen_matrix(words)
+        results = [None] * len(words)
+        for rows, flags in hyphens:
+            if masks:
+                packed = np.packbits(flags, axis=1, bitorder='little')
+                for r, row in zip(rows, packed):
+                    results[r] = int.from_bytes(row.tobytes(), 'little')
+                continue
+            # Interleave the characters with '-' where hyphens go and decode
+            # the whole block in one go; zero padding is dropped.
+            codes = _encode_block([words[r] for r in rows], flags.shape[1])
+            out = np.zeros((len(rows), 2 * flags.shape[1] + 1), dtype=np.uint32)
+            out[:, 0:-1:2] = codes
+            out[:, 1:-1:2] = np.where(flags, ord('-'), 0)
+            out[:, -1] = ord('\n')
+            text = out[out != 0].astype('<u4').tobytes().decode('utf-32-le')
+            for r, line in zip(rows, text.split('\n')):
+                results[r] = line
+        return results
+
+    def hyphen_matrix(self, words, left_min=2, right_min=2, letters=None):
+        """Yield (row indices, hyphen flags) blocks covering all words.
+
+        flags[i, k] is True if there is a hyphen after character k of
+        words[rows[i]].  Words are grouped by length to keep the padding small.
+        left_min and right_min are the shortest pieces allowed at either end
+        of a word; exceptions always use hyphenate_word's 2 and 2.  Words are
+        lowercased, or with letters (see pypatgen.read_translate) mapped to the
+        first representation of each letter, as patgen does.
+        """
+        import numpy as np
+
+        lowered = _fold(words, letters)
+        lengths = np.fromiter((len(w) for w in words), dtype=np.int64, count=len(words))
+        # Exceptions and words whose length changes when lowercased go
+        # through hyphenate_word, everything else is matched in bulk.
+        special = np.fromiter((len(lw) != len(w) or lw in self.exceptions
+                               for w, lw in zip(words, lowered)), dtype=bool, count=len(words))
 
-    patterns_file = sys.argv[1]
-    text_file = sys.argv[2]
+        order = np.argsort(lengths, kind='stable')
+        order = order[~special[order]]
+        for start in range(0, len(order), BATCH_SIZE):
+            rows = order[start:start + BATCH_SIZE]
+            yield rows, self._block_flags([lowered[r] for r in rows], lengths[rows],
+                                          left_min, right_min)
 
-    hyphenator = Hyphenator(patterns_file)
+        for r in np.flatnonzero(special):
+            flags = np.zeros((1, max(len(words[r]), 1)), dtype=bool)
+            k = -1
+            for piece in self.hyphenate_word(words[r])[:-1]:
+                k += len(piece)
+                flags[0, k] = True
+            yield np.array([r]), flags
 
-    with open(text_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            words = line.strip().split()
-            hyphenated_words = ['-'.join(hyphenator.hyphenate_word(word)) for word in words]
-            print(' '.join(hyphenated_words))
+    def _block_flags(self, lowered, lengths, left_min, right_min):
+        import numpy as np
+
+        width = int(lengths.max())
+        work = _encode_block(['.' + w + '.' for w in lowered], width + 2).astype(np.uint64)
+        points = np.zeros((len(lowered), width + 3), dtype=np.uint8)
+        hash_base, tables = self._ngram_tables()
+
+        h = np.zeros_like(work)
+        for length in range(1, width + 3):
+            # h[:, i] is the hash of work[:, i:i+length]
+            h = h[:, :-1] * hash_base + work[:, length - 1:] if length > 1 else work.copy()
+            if length not in tables:
+                continue
+            table_hashes, table_codes, table_points = tables[length]
+            idx = np.searchsorted(table_hashes, h)
+            idx[idx == len(table_hashes)] = 0
+            r, i = np.nonzero(table_hashes[idx] == h)
+            p = idx[r, i]
+            windows = np.lib.stride_tricks.sliding_window_view(work, length, axis=1)
+            exact = (windows[r, i] == table_codes[p]).all(axis=1)
+            r, i, p = r[exact], i[exact], p[exact]
+            # Within one length every n-gram matches at most one pattern, so
+            # the (r, i + k) targets are distinct and plain indexing is safe.
+            for k in range(length + 1):
+                points[r, i + k] = np.maximum(points[r, i + k], table_points[p, k])
+
+        flags = (points[:, 2:width + 2] % 2).astype(bool)
+        k = np.arange(width)
+        flags &= (k >= left_min - 1) & (k < (lengths - right_min)[:, None])
+        return flags
+
+    def _ngram_tables(self):
+        """Per pattern length: sorted hashes, code points and point vectors"""
+        if getattr(self, '_tables', None) is not None:
+            return self._tables
+        import numpy as np
+
+        by_length = {}
+        for chars, points in self.trie.patterns():
+            if chars:
+                by_length.setdefault(len(chars), []).append((chars, points))
+
+        # Retry with another base on the (unlikely) event of two patterns of
+        # the same length sharing a hash.
+        for hash_base in (np.uint64(1000003), np.uint64(2654435761), np.uint64(11400714819323198485)):
+            tables = {}
+            for length, patterns in by_length.items():
+                codes = _encode_block([c for c, _ in patterns], length).astype(np.uint64)
+                hashes = np.zeros(len(patterns), dtype=np.uint64)
+                for k in range(length):
+                    hashes = hashes * hash_base + codes[:, k]
+                order = np.argsort(hashes)
+                hashes = hashes[order]
+                if len(hashes) > 1 and (hashes[1:] == hashes[:-1]).any():
+                    break
+                points = np.array([p for _, p in patterns], dtype=np.uint8)
+                tables[length] = (hashes, codes[order], points[order])
+            else:
+                self._tables = (hash_base, tables)
+                return self._tables
+        raise RuntimeError("could not find a collision-free hash for the patterns")
+
+
+def _fold(words, letters):
+    """Words as the patterns see them: lowercased, or mapped through a translate file's letters"""
+    if letters is None:
+        return [w.lower() for w in words]
+    unknown = set(''.join(words)) - letters.keys()
+    if unknown:
+        raise ValueError(f"bad characters {''.join(sorted(unknown))!r}, not in the translate file")
+    table = str.maketrans({c: first for c, first in letters.items() if c != first})
+    return [w.translate(table) for w in words]
+
+
+def _encode_block(strings, width):
+    """Code points of strings as a zero-padded (len(strings), width) uint32 matrix"""
+    import numpy as np
+
+    lengths = np.fromiter((len(s) for s in strings), dtype=np.int64, count=len(strings))
+    flat = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype='<u4')
+    block = np.zeros((len(strings), width), dtype=np.uint32)
+    rows = np.repeat(np.arange(len(strings)), lengths)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    block[rows, cols] = flat
+    return block
+
+def _init_worker(patterns_file):
+    global _worker_hyphenator
+    _worker_hyphenator = Hyphenator(patterns_file)
+
+
+def _hyphenate_chunk(lines):
+    return _worker_hyphenator.hyphenate_lines(lines)
+
+
+def _read_chunks(f, n_lines):
+    while True:
+        chunk = list(islice(f, n_lines))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _positive_int(value):
+    jobs = int(value)
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyphenate a wordlist with TeX patterns.")
+    parser.add_argument('patterns_file', help="patterns in .tex or patgen format")
+    parser.add_argument('text_file', nargs='?', default='-', help="input text, '-' for stdin (default)")
+    parser.add_argument('--jobs', '-j', type=_positive_int, default=1,
+                        help="worker processes (default: 1)")
+    args = parser.parse_args()
+
+    jobs = args.jobs
+    # Compile (or refresh) the pattern cache once here, so the workers only mmap it.
+    # Lines go through the batched hyphenate_many, which does not use the per-word engine.
+    hyphenator = Hyphenator(args.patterns_file)
+
+    f = sys.stdin if args.text_file == '-' else open(args.text_file, 'r', encoding='utf-8')
+    out = open(sys.stdout.fileno(), 'w', encoding='utf-8', buffering=OUTPUT_BUFFER, closefd=False)
+    with f, out:
+        chunks = _read_chunks(f, CHUNK_LINES)
+        if jobs == 1:
+            for chunk in chunks:
+                out.write(hyphenator.hyphenate_lines(chunk))
+        else:
+            with Pool(jobs, initializer=_init_worker, initargs=(args.patterns_file,)) as pool:
+                # imap hands results back in input order, whichever worker finishes first.
+                for text in pool.imap(_hyphenate_chunk, chunks):
+                    out.write(text)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,234 @@
+# Caches of the intermediate pattern.N files of make-full-pattern.sh runs, and the
+# FileCache they are built on.
+#
+# pattern.N only depends on the dictionary, the translate file and the parameters of
+# levels 1..N, so it is stored under a hash of exactly these.  Parameter sets that
+# share their first levels then resume from the deepest level already computed
+# instead of starting over from an empty pattern.0.
+#
+# Entries are plain pattern files in CACHE_DIR.  Reading an entry bumps its mtime,
+# and the least recently used entries are removed once the directory grows over
+# MAX_BYTES.  Entries are written atomically, so pool workers can share the cache.
+
+import functools
+import hashlib
+import os
+import signal
+import subprocess
+import tempfile
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from early_stopping import read_patgen_counts
+from pypatgen import Dictionary, LevelParams, PatternTrainer, Translate, read_parameters
+
+CACHE_DIR = os.environ.get('LEVEL_CACHE_DIR', '/var/tmp/ipa-patterns/level-cache/')
+# 0 disables the cache
+MAX_BYTES = int(os.environ.get('LEVEL_CACHE_MAX_BYTES', 256 << 20))
+SUFFIX = '.pat'
+# How often make_full_pattern looks for finished levels when it reports them
+LOG_POLL_SECONDS = 0.5
+
+# Called with (level, (good, bad, missed)) after every level of training; may raise to abort it.
+LevelCallback = Callable[[int, Tuple[int, int, int]], None]
+
+
+# Digests by (filename, mtime, size), so unchanged corpora are not re-read on every call.
+# Bounded, since files in per-evaluation sandboxes are new every time in a long-lived worker.
+FILE_DIGESTS = 256
+
+@functools.lru_cache(maxsize=FILE_DIGESTS)
+def _content_digest(path: str, mtime_ns: int, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+def file_digest(*filenames: str) -> str:
+    h = hashlib.sha1()
+    for filename in filenames:
+        st = os.stat(filename)
+        h.update(_content_digest(os.path.abspath(filename), st.st_mtime_ns, st.st_size))
+    return h.hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """Hash of the repr of parts; they should only hold digests, strings and numbers"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def dictionary_digest(dictionary: Dictionary, translate: Translate) -> str:
+    h = hashlib.sha1()
+    for a in (dictionary.codes, dictionary.dots, dictionary.weights):
+        h.update(repr(a.shape).encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    letters = sorted(translate.letters.items()) if translate.letters is not None else None
+    h.update(repr((translate.left_min, translate.right_min, letters)).encode())
+    return h.hexdigest()
+
+
+class FileCache:
+    """Directory of content blobs by key, with LRU eviction over max_bytes"""
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+            return content
+        except OSError:
+            return None  # missing, or evicted by another worker in the meantime
+
+    def put(self, key: str, content: bytes):
+        if not self.enabled:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(SUFFIX):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class LevelCache(FileCache):
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        super().__init__(directory, max_bytes)
+
+    @staticmethod
+    def _key(corpus_key: str, runs: List[LevelParams]) -> str:
+        return cache_key(corpus_key, [tuple(run) for run in runs])
+
+    def deepest(self, corpus_key: str, runs: List[LevelParams]) -> Tuple[int, Optional[bytes]]:
+        """(n, content of pattern.n) for the largest cached n <= len(runs), (0, None) if none is"""
+        for n in range(len(runs), 0, -1):
+            content = self.get(self._key(corpus_key, runs[:n]))
+            if content is not None:
+                return n, content
+        return 0, None
+
+    def put_level(self, corpus_key: str, runs: List[LevelParams], content: bytes):
+        """Store pattern.n for the n = len(runs) levels of runs"""
+        self.put(self._key(corpus_key, runs), content)
+
+
+level_cache = LevelCache()
+
+
+def train_cached(dictionary: Dictionary, translate: Translate, runs: List[LevelParams],
+                 cache: LevelCache = level_cache, on_level: Optional[LevelCallback] = None) -> PatternTrainer:
+    """pypatgen.train, resuming from the deepest cached level and caching the levels it adds"""
+    corpus_key = dictionary_digest(dictionary, translate)
+    start, content = cache.deepest(corpus_key, runs)
+    patterns = content.decode('utf-8').split() if content is not None else ()
+    trainer = PatternTrainer(dictionary.translated(translate), translate.left_min, translate.right_min, patterns)
+    if on_level is not None and start > 0:
+        on_level(start, trainer.counts())
+    for n in range(start, len(runs)):
+        run = runs[n]
+        for hyph_level in range(run.hyph_start, run.hyph_finish + 1):
+            trainer.generate_level(hyph_level, run.pat_start, run.pat_finish,
+                                   run.good_wt, run.bad_wt, run.thresh)
+        cache.put_level(corpus_key, runs[:n + 1], ''.join(p + '\n' for p in trainer.patterns()).encode('utf-8'))
+        if on_level is not None:
+            on_level(n + 1, trainer.level_counts[-1])
+    return trainer
+
+
+def _run_reporting_levels(command: List[str], cwd: str, levels: range, on_level: LevelCallback,
+                          **popen_kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run of make-full-pattern.sh that passes the counts in pattern.N.log to on_level
+    as soon as level N is done, and kills the script if on_level raises"""
+    for level in levels:
+        log_file = os.path.join(cwd, f'pattern.{level}.log')
+        if os.path.exists(log_file):
+            os.remove(log_file)  # of an earlier run, would pass for a finished level
+    process = subprocess.Popen(command, cwd=cwd, start_new_session=True, **popen_kwargs)
+    pending = iter(levels)
+    level = next(pending, None)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=LOG_POLL_SECONDS)
+            done = True
+        except subprocess.TimeoutExpired:
+            done = False
+        # Level N is done once the script has started on pattern.N+1.log, or has exited.
+        while level is not None and (done or os.path.exists(os.path.join(cwd, f'pattern.{level + 1}.log'))):
+            counts = read_patgen_counts(os.path.join(cwd, f'pattern.{level}.log'))
+            if counts is None:
+                break  # patgen failed, the return code tells
+            try:
+                on_level(level, counts)
+            except BaseException:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.communicate()
+                raise
+            level = next(pending, None)
+        if done:
+            return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def make_full_pattern(dictionary_file: str, translate_file: str, params_file: str, cwd: str,
+                      cache: LevelCache = level_cache, on_level: Optional[LevelCallback] = None,
+                      **popen_kwargs) -> subprocess.CompletedProcess:
+    """Run make-full-pattern.sh in cwd, starting after the deepest cached level.
+
+    Like the script, leaves pattern.final in cwd; the script is not run at all if
+    every level is cached.  on_level gets the counts of every level the script runs.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'make-full-pattern.sh')
+    command = ['bash', script, dictionary_file, translate_file, params_file]
+    runs = read_parameters(params_file)
+    corpus_key = file_digest(dictionary_file, translate_file)
+    start, content = cache.deepest(corpus_key, runs)
+    if content is not None:
+        name = 'pattern.final' if start == len(runs) else f'pattern.{start}'
+        with open(os.path.join(cwd, name), 'wb') as f:
+            f.write(content)
+        if start == len(runs):
+            return subprocess.CompletedProcess(command, 0, b'', b'')
+
+    if on_level is None:
+        result = subprocess.run(command + [str(start + 1)], cwd=cwd, **popen_kwargs)
+    else:
+        result = _run_reporting_levels(command + [str(start + 1)], cwd, range(start + 1, len(runs) + 1),
+                                       on_level, **popen_kwargs)
+    if result.returncode == 0:
+        for n in range(start + 1, len(runs) + 1):
+            with open(os.path.join(cwd, f'pattern.{n}'), 'rb') as f:
+                cache.put_level(corpus_key, runs[:n], f.read())
+    return result
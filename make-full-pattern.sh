@@ -7,12 +7,14 @@
 #
 # Usage:
 #
-#   sh make-full-pattern.sh DICTIONARY_FILE TRANSLATE_FILE PARAMETERS_FILE
+#   sh make-full-pattern.sh DICTIONARY_FILE TRANSLATE_FILE PARAMETERS_FILE [START_LEVEL]
 #
 #
 # Input:   DICTIONARY_FILE    a list of hyphenated words
 #          TRANSLATE_FILE     for patgen, see patgen manpage
 #          PARAMETERS_FILE    parameters to supply to patgen
+#          START_LEVEL        first pass to run (default 1); pattern.$((START_LEVEL-1))
+#                             must already exist in the working directory
 #
 # Output:  pattmp.[1-8]       patgen results
 #          pattern.[0-8]      hyphenation patterns
@@ -26,16 +28,20 @@ set -e
 # Parameters for PATGEN, passes 1 to 8 sourced from PARAMETERS_FILE
 source $3
 
-rm -f pattern.0
-touch pattern.0
+start=${4:-1}
+if [ "$start" -eq 1 ]; then
+  rm -f pattern.0
+  touch pattern.0
+fi
 
 # Print all inputs
 echo "Inputs:"
 echo "DICTIONARY_FILE: $1"
 echo "TRANSLATE_FILE: $2"
 echo "PARAMETERS_FILE: $3"
+echo "START_LEVEL: $start"
 
-for i in 1 2 3 4 5 6 7 8; do
+for i in $(seq $start 8); do
 
   # Erzeuge Muster des aktuellen Levels.  Steuereingaben werden patgen
   # mittels einer Pipe übergeben.
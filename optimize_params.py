@@ -1,96 +1,478 @@
+import collections
+import ipaddress
+import itertools
 import pickle
 import os
-from typing import List, Tuple
+import queue
+import random
+import socket
+import threading
+import time
+from typing import List, Optional, Tuple
 import numpy as np
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+from scipy.stats import norm, qmc
+from surrogates import (SURROGATES, GPSurrogate, MultiOutputSurrogate, Surrogate, compare_surrogates,
+                        make_surrogate, same_kind)
+from early_stopping import EvaluationStopped, StoppedEvaluation, make_stopping_rule
+from evaluation_store import EVALUATION_DB, EvaluationStore
 
-from multiprocessing import Pool
+from multiprocessing import Pool, Process
+from multiprocessing.managers import BaseManager
 
+# Kept from the thesis runs, whose suggestions drew from the global generator.  Suggestions now
+# come from PatgenSampler.rng (Sobol design, lattice ascent), so this seed does not make those
+# runs replayable; nothing here draws from np.random any more.
 np.random.seed(42)
 
+# Surrogate model of the score, one of surrogates.SURROGATES
+SURROGATE = os.getenv('SURROGATE', 'gp')
+# Rate of calculate_score's exponential penalty of the bad ratio
+BAD_PENALTY = 5
+# What the surrogate models: 'score', the output of calculate_score, or 'ratios', the good and
+# bad ratios, which the score is applied to at prediction time.  With 'ratios', a change of
+# calculate_score keeps the whole history useful.
+SCORE_MODEL = os.getenv('SCORE_MODEL', 'score')
+# Monte Carlo draws of the predicted ratios the score mean and std are estimated from
+SCORE_SAMPLES = 64
+# Multi-task optimization: the saved observations of these target languages (comma separated)
+# are a correlated prior for the one being optimized, see PatgenSampler.import_task.
+RELATED_LANGUAGES = [lang for lang in os.getenv('RELATED_LANGUAGES', '').split(',') if lang]
+# Acquisition function of suggest_batch, one of ACQUISITIONS: the upper confidence bound, or the
+# expected improvement per second the evaluation is predicted to take (PatgenSampler.predict_seconds)
+ACQUISITION = os.getenv('ACQUISITION', 'ucb')
+ACQUISITIONS = ('ucb', 'ei-per-second')
+# Wall-clock budget of main_parallel and main_async in seconds, 0 for none.  With a budget,
+# exploration goes on until no more evaluations are predicted to finish in time.
+TIME_BUDGET = float(os.getenv('TIME_BUDGET', 0))
+# Early stopping of exploratory evaluations: none, or a comma separated list of
+# early_stopping.STOPPING_RULES
+STOPPING_RULE = os.getenv('STOPPING_RULE', 'none')
+# Candidates are predicted in chunks of at most this many candidate x observation kernel entries.
+PREDICT_CHUNK_ELEMENTS = 1 << 24
+# Per-column factors of _param_distance for encoded parameter sets: weight differences are
+# out of 7 * 4, params_ipa and params_single out of 5 * 4, threshold out of 8, averaged over 3.
+PARAM_DISTANCE_SCALE = np.array([1 / 28] * 4 + [1 / 20] * 8 + [1 / 8]) / 3
+# Bounds of the encoded parameters: weights, params_ipa, params_single, threshold
+PARAM_LOWER = np.array([0] * 4 + [1] * 4 + [1] * 4 + [1])
+PARAM_UPPER = np.array([8] * 4 + [8] * 4 + [8] * 4 + [8])
+# Place values that number the lattice points in mixed radix
+PARAM_PLACES = np.concatenate([[1], np.cumprod(PARAM_UPPER - PARAM_LOWER + 1)[:-1]]).astype(np.int64)
+# Features of an observation: the encoded parameters and the fidelity it was evaluated at
+N_FEATURES = len(PARAM_LOWER) + 1
+# Successive halving: candidates start at fidelity HALVING_ETA**-HALVING_RUNGS, the best
+# 1/HALVING_ETA of every rung go on at HALVING_ETA times the fidelity, up to full fidelity.
+HALVING_ETA = 3
+HALVING_RUNGS = 2
+# main_distributed: host:port of the coordinator, which workers connect to with the shared key.
+# The coordinator and the workers unpickle whatever their peers send, so anything but a
+# loopback address (like 0.0.0.0:port, for workers on other hosts) needs a secret key.
+COORDINATOR_ADDRESS = os.getenv('COORDINATOR_ADDRESS', 'localhost:50007')
+COORDINATOR_AUTHKEY = os.getenv('COORDINATOR_AUTHKEY', '').encode() or None
+# Key of loopback addresses when COORDINATOR_AUTHKEY is not set
+LOOPBACK_AUTHKEY = b'ipa-patterns'
+# How long a worker keeps trying to reach a coordinator that is not up yet
+WORKER_CONNECT_SECONDS = 30.0
+# Workers report on their running task this often; one not heard of for HEARTBEAT_TIMEOUT
+# seconds is taken for dead and its task handed out again.
+HEARTBEAT_SECONDS = float(os.getenv('HEARTBEAT_SECONDS', 10))
+HEARTBEAT_TIMEOUT = float(os.getenv('HEARTBEAT_TIMEOUT', 60))
+# How often an idle worker asks for a task
+WORKER_POLL_SECONDS = 1.0
+# Root of the per-evaluation seeds of main_reproducible_parallel, see task_seed
+REPRODUCIBLE_SEED = 42
+# Acquisition maximization: local searches from this many seeds, of at most this many steps
+ASCENT_SEEDS = 32
+LATTICE_ASCENT_STEPS = 30
+
 def evaluate_params(args):
-    """Helper function for parallel evaluation"""
-    input_files, weights, params_ipa, params_single, threshold, language, workdir_i = args
-    good, bad, missed = sample(input_files, weights, params_ipa, params_single, threshold, language, workdir_i)
-    return good, bad, missed
+    """Helper function for parallel evaluation.  Optional trailing args: fidelity, stopping rule,
+    an EvaluationStore the result is committed to (and looked up in first), and a seed of the
+    global random generators for the evaluation"""
+    return evaluate_params_timed(args)[0]
+
+def evaluate_params_timed(args):
+    """evaluate_params, and the seconds of the stages of the evaluation (None if it was stored or
+    cached)"""
+    input_files, weights, params_ipa, params_single, threshold, language, workdir_i = args[:7]
+    fidelity = args[7] if len(args) > 7 else 1.0
+    stopping = args[8] if len(args) > 8 else None
+    store = args[9] if len(args) > 9 else None
+    seed = args[10] if len(args) > 10 else None
+    if seed is not None:
+        # Pool workers run many evaluations; without this, any draw from the global generators
+        # would depend on which worker runs it and what it ran before.
+        random.seed(seed)
+        np.random.seed(seed)
+    params = (weights, params_ipa, params_single, threshold)
+    if store is not None:
+        corpus = corpus_digest(input_files, language)
+        # Evaluations that must not be stopped do not take a stored early stop for an answer.
+        stored = store.lookup(language, corpus, params, fidelity, completed=stopping is None)
+        if stored is not None:
+            return stored, None
+    timings = {}
+    start = time.time()
+    try:
+        result = sample(input_files, weights, params_ipa, params_single, threshold, language, workdir_i,
+                        fidelity, stopping, timings)
+    except EvaluationStopped as e:
+        result = e.stopped
+    if timings:
+        timings['total'] = time.time() - start
+    else:
+        timings = None  # sample() found the result in its cache, the time says nothing about the cost
+    if store is not None:
+        score = None if isinstance(result, StoppedEvaluation) else PatgenSampler.calculate_score(*result)
+        store.add(language, corpus, params, fidelity, result, score, timings)
+    return result, timings
 
 
 class PatgenSampler:
-    def __init__(self):
+    def __init__(self, surrogate: str = SURROGATE, score_model: str = SCORE_MODEL, related_tasks=(),
+                 acquisition: str = ACQUISITION):
         self.rng = np.random.RandomState(42)
-        kernel = Matern(nu=2.5, length_scale=[1.0] * 13, length_scale_bounds=(1e-5, 1e10)) + \
-                WhiteKernel(noise_level=0.1, noise_level_bounds=(1e-4, 1))
-        
-        self.gp = GaussianProcessRegressor(
-            kernel=kernel,
-            normalize_y=True,
-            random_state=42,
-            #alpha=0.1,
-            n_restarts_optimizer=2
-        )
+        self.score_model = score_model
+        if acquisition not in ACQUISITIONS:
+            raise ValueError(f"unknown acquisition {acquisition}, expected one of {', '.join(ACQUISITIONS)}")
+        self.acquisition = acquisition
+        # Observations of related tasks (target languages) are fitted along with this task's,
+        # with a one-hot column per related task, which are all 0 for this task's own.  Their
+        # length scales learn how much the tasks have in common.
+        self.related_tasks = tuple(related_tasks)
+        self.n_features = N_FEATURES + len(self.related_tasks)
+        self.task_X = []
+        self.task_y = []
+        self.task_ratios = []
+        if score_model == 'score':
+            self.surrogate: Surrogate = make_surrogate(surrogate, self.n_features)
+        elif score_model == 'ratios':
+            self.surrogate = MultiOutputSurrogate(surrogate, self.n_features, 2)
+        else:
+            raise ValueError(f"unknown score model {score_model}, expected score or ratios")
         self.X = []
         self.y = []
+        # (good ratio, bad ratio) of every observation, None where the counts are unknown
+        self.ratios = []
+        # Standard normal draws of the Monte Carlo score, the same for every prediction
+        self._score_normals = np.random.RandomState(0).standard_normal((SCORE_SAMPLES, 2))
+        # (encoded observation, StoppedEvaluation) of the evaluations stopped early
+        self.censored = []
+        # Encoded parameters of the evaluations that raised; they are not suggested again
+        self.failed = []
+        # Id of the last EvaluationStore row taken in by sync
+        self.store_position = 0
+        # Model of the log seconds an evaluation takes, fitted on the encoded observations of
+        # the completed evaluations in the store
+        self.runtime: Surrogate = make_surrogate(surrogate, N_FEATURES)
+        self.runtime_X = []
+        self.runtime_y = []
+        # Scrambled Sobol sequence of the initial design, and its points not handed out yet
+        self._sobol = None
+        self._design = []
 
     def save_state(self, filename: str):
         """Save model and training data"""
         state = {
-            'gp': self.gp,
+            'surrogate': self.surrogate,
             'X': self.X,
-            'y': self.y
+            'y': self.y,
+            'ratios': self.ratios,
+            'censored': self.censored,
+            'failed': self.failed,
+            'store_position': self.store_position,
+            'related_tasks': self.related_tasks,
+            'runtime': self.runtime,
+            'runtime_X': self.runtime_X,
+            'runtime_y': self.runtime_y
         }
         with open(filename, 'wb') as f:
             pickle.dump(state, f)
             
     @classmethod
-    def load_state(cls, filename: str):
-        """Create a new sampler with loaded state"""
-        sampler = cls()
+    def load_state(cls, filename: str, related_states: dict = None):
+        """Create a new sampler with loaded state, and the observations of the related tasks
+        in related_states (task: state filename)"""
+        related_states = related_states or {}
+        sampler = cls(related_tasks=tuple(related_states))
+        for task, related_filename in related_states.items():
+            sampler.import_task(task, related_filename)
+        saved = saved_runtime = None
         if os.path.exists(filename):
             with open(filename, 'rb') as f:
                 state = pickle.load(f)
-                sampler.gp = state['gp']
-                sampler.X = state['X']
+                # Observations saved before fidelities existed were all at full fidelity.
+                upgraded = any(len(x) < N_FEATURES for x in state['X'])
+                sampler.X = [list(x) + [1.0] if len(x) < N_FEATURES else x for x in state['X']]
                 sampler.y = state['y']
+                sampler.ratios = state.get('ratios', [None] * len(sampler.y))
+                if sampler.score_model == 'ratios':
+                    # Scores under the current calculate_score, which may have changed since
+                    sampler.y = [float(sampler.score_from_ratios(*r)) if r is not None else y
+                                 for r, y in zip(sampler.ratios, sampler.y)]
+                sampler.censored = state.get('censored', [])
+                sampler.failed = state.get('failed', [])
+                sampler.store_position = state.get('store_position', 0)
+                sampler.runtime_X = state.get('runtime_X', [])
+                sampler.runtime_y = state.get('runtime_y', [])
+                saved_runtime = state.get('runtime')
+                # States saved before surrogates were pluggable hold a bare GP.
+                saved = state['surrogate'] if 'surrogate' in state else GPSurrogate(state['gp'])
+                if upgraded or tuple(state.get('related_tasks', ())) != sampler.related_tasks:
+                    saved = None
             print(f"Loaded {len(sampler.X)} observations from {filename}")
+        X, targets = sampler._training_data()
+        if saved is not None and same_kind(saved, sampler.surrogate) and saved.n_observations == len(X):
+            sampler.surrogate = saved
+        elif len(X) >= 5:
+            # Another backend, score model or set of related observations, build it from the history.
+            sampler.surrogate.observe(X, targets)
+        if (saved_runtime is not None and same_kind(saved_runtime, sampler.runtime)
+                and saved_runtime.n_observations == len(sampler.runtime_y)):
+            sampler.runtime = saved_runtime
+        elif len(sampler.runtime_y) >= 5:
+            sampler.runtime.observe(np.array(sampler.runtime_X, dtype=float), np.array(sampler.runtime_y))
         return sampler
 
+    def import_task(self, task: str, filename: str):
+        """Take in the observations of a related task from its saved state, as a prior for this
+        task; before any observation of this task, as they come first in the training data"""
+        if not os.path.exists(filename):
+            print(f"No saved state {filename} of related task {task}")
+            return
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        one_hot = [1.0 if t == task else 0.0 for t in self.related_tasks]
+        ratios = state.get('ratios', [None] * len(state['y']))
+        for x, y, r in zip(state['X'], state['y'], ratios):
+            x = list(x) + [1.0] if len(x) < N_FEATURES else list(x)
+            self.task_X.append(x + one_hot)
+            self.task_y.append(float(self.score_from_ratios(*r)) if r is not None and self.score_model == 'ratios'
+                               else y)
+            self.task_ratios.append(r)
+        print(f"Imported {len(state['y'])} observations of related task {task} from {filename}")
+
     def _encode_params(self, weights: Tuple[int, ...], params_ipa: Tuple[int, ...], 
                       params_single: Tuple[int, ...], threshold: int) -> List[float]:
         """Convert parameters to feature vector"""
         return list(weights) + list(params_ipa) + list(params_single) + [threshold]
+
+    def _encode_observation(self, weights: Tuple[int, ...], params_ipa: Tuple[int, ...],
+                            params_single: Tuple[int, ...], threshold: int, fidelity: float = 1.0) -> List[float]:
+        """Feature vector of an evaluation: the parameters and the fidelity"""
+        return self._encode_params(weights, params_ipa, params_single, threshold) + [fidelity]
     
         
     def _predict(self, weights: Tuple[int, ...], params_ipa: Tuple[int, ...], 
                 params_single: Tuple[int, ...], threshold: int) -> Tuple[float, float]:
         """Get prediction and uncertainty for a parameter set"""
-        if len(self.X) < 5:
+        if self.surrogate.n_observations < 5:
             return 0.5, 1.0
             
-        x = self._encode_params(weights, params_ipa, params_single, threshold)
+        x = self._encode_observation(weights, params_ipa, params_single, threshold)
         x_arr = np.array([x])
-        pred, std = self.gp.predict(x_arr, return_std=True)
+        pred, std = self._predict_many(x_arr)
         return float(pred[0]), float(std[0])
 
     def update(self, weights: Tuple[int, ...], params_ipa: Tuple[int, ...], 
-               params_single: Tuple[int, ...], threshold: int, score: float):
+               params_single: Tuple[int, ...], threshold: int, score: float, fidelity: float = 1.0,
+               counts=None):
         """Update model with new observation"""
-        x = self._encode_params(weights, params_ipa, params_single, threshold)
-        self.X.append(x)
-        self.y.append(score)
-        
-        if len(self.X) >= 5:
-            X_array = np.vstack(self.X)
-            y_array = np.array(self.y)
-            self.gp.fit(X_array, y_array)
+        self.update_batch([(weights, params_ipa, params_single, threshold, score, fidelity, counts)])
+
+    def update_batch(self, observations: List[Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...], int, float]]):
+        """Update model with several (weights, params_ipa, params_single, threshold, score[, fidelity[, counts]])
+        observations.  counts are the (good, bad, missed) of the evaluation, or the StoppedEvaluation
+        of one stopped early; the 'ratios' score model only learns from observations with counts."""
+        for weights, params_ipa, params_single, threshold, score, *rest in observations:
+            fidelity = rest[0] if rest else 1.0
+            counts = rest[1] if len(rest) > 1 else None
+            self.X.append(self._encode_observation(weights, params_ipa, params_single, threshold, fidelity))
+            self.y.append(score)
+            self.ratios.append(self._observed_ratios(counts))
+
+        X, targets = self._training_data()
+        if len(X) >= 5:
+            self.surrogate.observe(X, targets)
+
+    def _observed_ratios(self, counts) -> Optional[Tuple[float, float]]:
+        if counts is None:
+            return None
+        if isinstance(counts, StoppedEvaluation):
+            # Judged poor, like censored_observation's score
+            known = [r for r in self.ratios if r is not None]
+            return (min(g for g, _ in known), max(b for _, b in known)) if known else None
+        good, bad, missed = counts
+        total = max(1, good + bad + missed)
+        return good / total, bad / total
+
+    def _task_features(self, X) -> np.ndarray:
+        """Encoded observations of this task, with the related task columns (all 0) appended"""
+        X = np.asarray(X, dtype=float).reshape(-1, N_FEATURES)
+        return np.hstack([X, np.zeros((len(X), len(self.related_tasks)))])
+
+    def _training_data(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Features and targets the surrogate is fitted on: all observations, of the related tasks
+        first, and their scores, or, for the 'ratios' score model, those with known ratios and these"""
+        X = np.vstack([np.array(self.task_X, dtype=float).reshape(-1, self.n_features), self._task_features(self.X)])
+        if self.score_model == 'score':
+            return X, np.array(self.task_y + self.y, dtype=float)
+        ratios = self.task_ratios + self.ratios
+        rows = [i for i, r in enumerate(ratios) if r is not None]
+        return X[rows], np.array([ratios[i] for i in rows], dtype=float).reshape(-1, 2)
+
+    def _worst_target(self):
+        """Target of the 'constant' liar: the worst score, or the worst good and bad ratios, seen so far"""
+        _, targets = self._training_data()
+        if self.score_model == 'score':
+            return targets.min()
+        return [targets[:, 0].min(), targets[:, 1].max()]
+
+    def observe_runtimes(self, observations):
+        """Update the runtime model with (params, fidelity, seconds) of completed evaluations"""
+        for params, fidelity, seconds in observations:
+            self.runtime_X.append(self._encode_observation(*params, fidelity))
+            self.runtime_y.append(float(np.log(max(seconds, 1e-3))))
+        if len(self.runtime_y) >= 5:
+            self.runtime.observe(np.array(self.runtime_X, dtype=float), np.array(self.runtime_y))
+
+    def predict_seconds(self, X: np.ndarray) -> np.ndarray:
+        """Predicted seconds of evaluations of encoded parameter sets (at full fidelity if without
+        one); all 1 until the runtime model has observations"""
+        X = np.asarray(X, dtype=float)
+        if X.shape[1] < N_FEATURES:
+            X = np.hstack([X, np.ones((len(X), 1))])
+        if self.runtime.n_observations < 5:
+            return np.ones(len(X))
+        return np.exp(self.runtime.predict(X, return_std=False))
+
+    def _random_param_matrix(self, n: int) -> np.ndarray:
+        """n random parameter sets, encoded as the rows of an (n, 13) integer matrix"""
+        return self.rng.randint(PARAM_LOWER, PARAM_UPPER + 1, size=(n, len(PARAM_LOWER)))
+
+    def _lattice_keys(self, X) -> np.ndarray:
+        """A distinct integer for every encoded parameter set"""
+        X = np.asarray(X, dtype=np.int64).reshape(-1, len(PARAM_LOWER))
+        return (X - PARAM_LOWER) @ PARAM_PLACES
+
+    def _excluded_keys(self, pending=()) -> np.ndarray:
+        """Keys of the parameter sets already evaluated at full fidelity, failed or still being evaluated"""
+        evaluated = [x[:len(PARAM_LOWER)] for x in self.X if x[-1] >= 1.0]
+        return self._lattice_keys(evaluated + self.failed + [self._encode_params(*params) for params in pending])
+
+    def _initial_design(self, n: int, pending=()) -> np.ndarray:
+        """Next n points of a scrambled Sobol sequence mapped onto the lattice, leaving out
+        points already evaluated, pending or handed out before"""
+        if self._sobol is None:
+            self._sobol = qmc.Sobol(d=len(PARAM_LOWER), scramble=True, seed=self.rng)
+        taken = set(self._excluded_keys(pending).tolist())
+        rows = []
+        while len(rows) < n:
+            if not self._design:
+                # Doubling keeps the number of points drawn a power of 2, which the
+                # balance properties of the sequence rely on.
+                u = self._sobol.random(max(8, self._sobol.num_generated))
+                self._design = list(PARAM_LOWER + np.floor(u * (PARAM_UPPER - PARAM_LOWER + 1)).astype(int))
+            row = self._design.pop(0)
+            key = int(self._lattice_keys(row)[0])
+            if key not in taken:
+                taken.add(key)
+                rows.append(row)
+        return np.array(rows)
+
+    def _decode_params(self, x) -> Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...], int]:
+        """Inverse of _encode_params"""
+        x = [int(v) for v in x]
+        return tuple(x[0:4]), tuple(x[4:8]), tuple(x[8:12]), x[12]
 
     def _random_params(self) -> Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...], int]:
         """Generate random parameter sets"""
-        weights = tuple(np.random.randint(0, 9, size=4))
-        params_ipa = tuple(np.random.randint(1, 9, size=4))
-        params_single = tuple(np.random.randint(1, 9, size=4))
-        threshold = np.random.randint(1,9)
-        return weights, params_ipa, params_single, threshold
+        return self._decode_params(self._random_param_matrix(1)[0])
+
+    def _predict_many(self, X: np.ndarray, return_std: bool = True):
+        """surrogate.predict in chunks, to bound the memory of the candidate x training kernel matrix.
+        Encoded parameter sets without a fidelity are predicted at full fidelity, and all of them
+        for this task."""
+        if X.shape[1] < N_FEATURES:
+            X = np.hstack([X, np.ones((len(X), 1))])
+        if X.shape[1] < self.n_features:
+            X = self._task_features(X)
+        chunk = max(1, PREDICT_CHUNK_ELEMENTS // max(1, self.surrogate.n_observations))
+        if self.score_model == 'ratios':
+            chunk = max(1, min(chunk, PREDICT_CHUNK_ELEMENTS // SCORE_SAMPLES))
+            parts = [self._score_distribution(*self.surrogate.predict(X[i:i + chunk], return_std=True))
+                     for i in range(0, len(X), chunk)]
+            parts = [(m, sd) if return_std else m for m, sd in parts]
+        else:
+            parts = [self.surrogate.predict(X[i:i + chunk], return_std=return_std) for i in range(0, len(X), chunk)]
+        if not return_std:
+            return np.concatenate(parts)
+        return np.concatenate([m for m, _ in parts]), np.concatenate([sd for _, sd in parts])
+
+    def _ucb(self, X: np.ndarray) -> np.ndarray:
+        mean, std = self._predict_many(X)
+        return mean + 2.0 * std
+
+    def _mean(self, X: np.ndarray) -> np.ndarray:
+        return self._predict_many(X, return_std=False)
+
+    def _incumbent(self) -> float:
+        """Best score observed at full fidelity, the one to improve on"""
+        full = [y for x, y in zip(self.X, self.y) if x[-1] >= 1.0]
+        return max(full or self.task_y or [0.0])
+
+    def _ei_per_second(self, X: np.ndarray) -> np.ndarray:
+        mean, std = self._predict_many(X)
+        std = np.maximum(std, 1e-12)
+        z = (mean - self._incumbent()) / std
+        ei = (mean - self._incumbent()) * norm.cdf(z) + std * norm.pdf(z)
+        return ei / self.predict_seconds(X)
+
+    def best_observed(self):
+        """(params, score) of the best evaluation at full fidelity, None if there is none"""
+        full = [(y, x) for x, y in zip(self.X, self.y) if x[-1] >= 1.0]
+        if not full:
+            return None
+        score, x = max(full, key=lambda observation: observation[0])
+        return self._decode_params(x[:len(PARAM_LOWER)]), score
+
+    def _lattice_ascent(self, X: np.ndarray, values: np.ndarray, acquisition,
+                        max_steps: int = LATTICE_ASCENT_STEPS) -> Tuple[np.ndarray, np.ndarray]:
+        """Move every point to its best lattice neighbour (one parameter +-1) for as long as
+        that raises the acquisition; all points step together, with one prediction per step"""
+        X = X.copy()
+        values = values.copy()
+        steps = np.vstack([np.eye(X.shape[1], dtype=X.dtype), -np.eye(X.shape[1], dtype=X.dtype)])
+        active = np.arange(len(X))
+        for _ in range(max_steps):
+            if len(active) == 0:
+                break
+            neighbours = X[active, None, :] + steps[None, :, :]
+            flat = neighbours.reshape(-1, X.shape[1])
+            valid = ((flat >= PARAM_LOWER) & (flat <= PARAM_UPPER)).all(axis=1)
+            neighbour_values = np.full(len(flat), -np.inf)
+            neighbour_values[valid] = acquisition(flat[valid])
+            neighbour_values = neighbour_values.reshape(len(active), len(steps))
+            best = neighbour_values.argmax(axis=1)
+            best_values = neighbour_values[np.arange(len(active)), best]
+            improved = best_values > values[active]
+            moved = active[improved]
+            X[moved] = neighbours[improved, best[improved]]
+            values[moved] = best_values[improved]
+            active = moved
+        return X, values
+
+    def _acquisition_candidates(self, acquisition, n_candidates: int,
+                                n_seeds: int = ASCENT_SEEDS) -> Tuple[np.ndarray, np.ndarray]:
+        """Random lattice points plus the local maxima of the acquisition reached from the best
+        of them and from some random ones, without duplicates, with their acquisition values"""
+        X = self._random_param_matrix(n_candidates)
+        values = acquisition(X)
+        order = np.argsort(values)
+        seeds = np.unique(np.concatenate([order[-(n_seeds // 2):],
+                                          self.rng.randint(0, len(X), size=n_seeds - n_seeds // 2)]))
+        X_ascended, ascended_values = self._lattice_ascent(X[seeds], values[seeds], acquisition)
+        X, first = np.unique(np.vstack([X, X_ascended]), axis=0, return_index=True)
+        return X, np.concatenate([values, ascended_values])[first]
 
     def _param_distance(self, params1: Tuple[Tuple[int, ...], ...], 
                        params2: Tuple[Tuple[int, ...], ...]) -> float:
@@ -109,7 +491,8 @@ class PatgenSampler:
         
         return (w_dist + i_dist + s_dist + t_dist) / 3
 
-    def calculate_score(self, good: int, bad: int, missed: int) -> float:
+    @staticmethod
+    def calculate_score(good: int, bad: int, missed: int) -> float:
         """
         Score based on:
         - bad count is the most important (exponentially worse as it increases)
@@ -117,86 +500,169 @@ class PatgenSampler:
         - missed count matters least
         """
         total = good + bad + missed
-        
+        return float(PatgenSampler.score_from_ratios(good / total, bad / total))
+
+    @staticmethod
+    def score_from_ratios(good_ratio, bad_ratio):
+        """calculate_score of good and bad ratios, elementwise for arrays"""
         # Exponentially penalize bad hyphenations
-        bad_ratio = bad / total
-        bad_penalty = np.exp(bad_ratio * 5) - 1  # exponential penalty
-        
-        # Reward good hyphenations
-        good_ratio = good / total
+        bad_penalty = np.exp(bad_ratio * BAD_PENALTY) - 1  # exponential penalty
         
         # Combine (normalizing to 0-1)
         score = good_ratio - bad_penalty
-        return max(0.0, min(1.0, (score + 1) / 2))
+        return np.clip((score + 1) / 2, 0.0, 1.0)
+
+    def _score_distribution(self, mean: np.ndarray, std: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Mean and std of the score of (n, 2) normally distributed good and bad ratios, by Monte Carlo
+        with the same draws for every row"""
+        draws = mean[:, None, :] + std[:, None, :] * self._score_normals[None]
+        bad = np.clip(draws[..., 1], 0.0, 1.0)
+        good = np.clip(draws[..., 0], 0.0, 1.0 - bad)
+        scores = self.score_from_ratios(good, bad)
+        return scores.mean(axis=1), scores.std(axis=1)
     
-    def suggest_batch(self, n_suggestions: int = 5, n_candidates: int = 10000) -> List[Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]]:
-        """Suggest a batch of diverse, promising parameter sets with predictions"""
-        if len(self.X) < 5:
-            suggestions = [self._random_params() for _ in range(n_suggestions)]
+    def censored_observation(self, params, stopped: StoppedEvaluation, fidelity: float = 1.0):
+        """Observation for update_batch of an evaluation stopped early.  Its score is unknown
+        but judged poor, so it enters the model with the worst score seen so far, like the
+        'constant' liar; it is also kept in self.censored."""
+        self.censored.append((self._encode_observation(*params, fidelity), stopped))
+        return (*params, min(self.task_y + self.y, default=0.0), fidelity, stopped)
+
+    def record_failure(self, params):
+        """Keep a parameter set whose evaluation raised from being suggested again.  Nothing is
+        known about its score, so the model does not learn from it."""
+        self.failed.append(self._encode_params(*params))
+
+    def sync(self, store: EvaluationStore, language: str, corpus: str):
+        """Take in the evaluations stored since the last sync, except those of this process
+        (store.owner), which come in through their results.  The runtime model learns from
+        all completed ones."""
+        observations = []
+        runtimes = []
+        for row in store.since(language, corpus, self.store_position):
+            self.store_position = row.id
+            # Only rows with stage timings were really evaluated, not found in a cache
+            if row.timings and 'joint' in row.timings and not isinstance(row.result, StoppedEvaluation):
+                runtimes.append((row.params, row.fidelity, row.timings['total']))
+            if row.owner == store.owner:
+                continue
+            if isinstance(row.result, StoppedEvaluation):
+                observations.append(self.censored_observation(row.params, row.result, row.fidelity))
+            else:
+                observations.append((*row.params, self.calculate_score(*row.result), row.fidelity, row.result))
+        if observations:
+            print(f"Took in {len(observations)} stored evaluations")
+            self.update_batch(observations)
+        if runtimes:
+            self.observe_runtimes(runtimes)
+
+    def _fantasy_surrogate(self, pending, liar: str) -> Surrogate:
+        """Surrogate that also believes the pending (still evaluating) parameter sets have a made-up
+        outcome: the worst seen so far ('constant') or its own prediction ('kriging-believer')"""
+        X_pending = self._task_features([self._encode_observation(*params) for params in pending])
+        if liar == 'kriging-believer':
+            lies = self.surrogate.predict(X_pending)
+        elif liar == 'constant':
+            lies = np.array([self._worst_target()] * len(pending), dtype=float)
+        else:
+            raise ValueError(f"unknown liar {liar}")
+        return self.surrogate.conditioned(X_pending, lies)
+
+    def suggest_batch(self, n_suggestions: int = 5, n_candidates: int = 10000, pending=(),
+                      liar: str = 'constant') -> List[Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]]:
+        """Suggest a batch of diverse, promising parameter sets with predictions.
+        pending are parameter sets still being evaluated, suggestions keep away from them.
+        Nothing already evaluated or pending is suggested."""
+        if self.surrogate.n_observations < 5:
+            suggestions = [self._decode_params(x) for x in self._initial_design(n_suggestions, pending)]
             return [(params, *self._predict(*params)) for params in suggestions]
-            
-        # Generate candidates
-        candidates = [self._random_params() for _ in range(n_candidates)]
-        X_candidates = np.array([self._encode_params(*c) for c in candidates])
-        
-        # Get predictions and uncertainties
-        mean, std = self.gp.predict(X_candidates, return_std=True)
-        scores = mean + 2.0 * std
+
+        real_surrogate = self.surrogate
+        if pending:
+            self.surrogate = self._fantasy_surrogate(pending, liar)
+        try:
+            return self._suggest_diverse(n_suggestions, n_candidates, pending)
+        finally:
+            self.surrogate = real_surrogate
+
+    def _suggest_diverse(self, n_suggestions: int, n_candidates: int, pending):
+        # Generate candidates and their acquisition values
+        acquisition = self._ei_per_second if self.acquisition == 'ei-per-second' else self._ucb
+        X_candidates, scores = self._acquisition_candidates(acquisition, n_candidates)
+        fresh = ~np.isin(self._lattice_keys(X_candidates), self._excluded_keys(pending))
+        X_candidates, scores = X_candidates[fresh], scores[fresh]
         
         # Select diverse set from top quartile
         top_quartile = np.percentile(scores, 75)
-        good_indices = np.where(scores >= top_quartile)[0]
-        
-        selected = []
-        selected_indices = []
+        good_indices = np.flatnonzero(scores >= top_quartile)
+        good = X_candidates[good_indices]
         
         # Always include the absolute best
-        best_idx = np.argmax(scores)
-        selected.append(candidates[best_idx])
-        selected_indices.append(best_idx)
+        best_idx = int(np.argmax(scores))
+        selected_rows = [X_candidates[best_idx]]
+        # Distance of every good candidate to its nearest selected one (see _param_distance),
+        # -1 for those already selected
+        min_dist = np.abs(good - selected_rows[0]) @ PARAM_DISTANCE_SCALE
+        min_dist[good_indices == best_idx] = -1
         
-        while len(selected) < n_suggestions and len(good_indices) > 0:
-            max_min_dist = -1
-            best_idx = -1
-            
-            for idx in good_indices:
-                if idx in selected_indices:
-                    continue
-                    
-                dists = [self._param_distance(candidates[idx], sel) 
-                        for sel in selected]
-                min_dist = min(dists)
-                
-                if min_dist > max_min_dist:
-                    max_min_dist = min_dist
-                    best_idx = idx
-            
-            if best_idx != -1:
-                selected.append(candidates[best_idx])
-                selected_indices.append(best_idx)
-                good_indices = good_indices[good_indices != best_idx]
-            else:
-                break
+        while len(selected_rows) < n_suggestions and len(good) > 0:
+            best_idx = int(np.argmax(min_dist))
+            if min_dist[best_idx] < 0:
+                break  # all good candidates are taken
+            selected_rows.append(good[best_idx])
+            min_dist = np.minimum(min_dist, np.abs(good - good[best_idx]) @ PARAM_DISTANCE_SCALE)
+            min_dist[best_idx] = -1
                 
         # Add predictions for selected candidates
-        return [(params, *self._predict(*params)) for params in selected]
+        X_selected = np.array(selected_rows)
+        mean, std = self._predict_many(X_selected)
+        return [(self._decode_params(x), float(m), float(sd)) for x, m, sd in zip(X_selected, mean, std)]
         
-    def exploit_best_candidates(self, n_suggestions=10, n_candidates=20000):
-        """Generate many candidates and return the ones with highest predicted scores, no exploration"""
-        if len(self.X) < 5:
-            return self.suggest_batch(n_suggestions)
+    def exploit_best_candidates(self, n_suggestions=10, n_candidates=20000, pending=()):
+        """Generate many candidates and return the ones with highest predicted scores, no exploration.
+        Nothing already evaluated or pending is suggested."""
+        if self.surrogate.n_observations < 5:
+            return self.suggest_batch(n_suggestions, pending=pending)
             
-        # Generate lots of candidates
-        candidates = [self._random_params() for _ in range(n_candidates)]
-        X_candidates = np.array([self._encode_params(*c) for c in candidates])
-        
-        # Get just predictions, no uncertainty consideration
-        mean = self.gp.predict(X_candidates)
+        # Generate lots of candidates, with just predictions, no uncertainty consideration
+        X_candidates, mean = self._acquisition_candidates(self._mean, n_candidates)
+        fresh = ~np.isin(self._lattice_keys(X_candidates), self._excluded_keys(pending))
+        X_candidates, mean = X_candidates[fresh], mean[fresh]
         
         # Get top predicted performers
         top_indices = np.argsort(mean)[-n_suggestions:][::-1]
         
-        return [(candidates[i], float(mean[i]), 0.0) for i in top_indices]  # Convert to float for safety
+        return [(self._decode_params(X_candidates[i]), float(mean[i]), 0.0) for i in top_indices]  # Convert to float for safety
+
+def load_sampler(language: str) -> PatgenSampler:
+    """The saved sampler of a target language, with the RELATED_LANGUAGES as prior"""
+    related = {task: f"work/model{task}.pkl" for task in RELATED_LANGUAGES if task != language}
+    return PatgenSampler.load_state(f"work/model{language}.pkl", related)
+
+def predicted_seconds(sampler: PatgenSampler, eval_args) -> np.ndarray:
+    """sampler.predict_seconds of the evaluations of evaluate_params args"""
+    X = [sampler._encode_observation(*args[1:5], args[7] if len(args) > 7 else 1.0) for args in eval_args]
+    return sampler.predict_seconds(np.array(X, dtype=float))
+
+def predicted_round_seconds(sampler: PatgenSampler, eval_args, n_processes: int) -> float:
+    """Predicted wall-clock seconds of evaluating eval_args on n_processes"""
+    seconds = predicted_seconds(sampler, eval_args)
+    return float(max(seconds.max(), seconds.sum() / n_processes)) if len(seconds) else 0.0
+
+def map_longest_first(pool, sampler: PatgenSampler, eval_args) -> list:
+    """pool.map of evaluate_params, starting the evaluations predicted to take longest first so
+    the short ones fill up the end of the round; results in the order of eval_args"""
+    order = np.argsort(-predicted_seconds(sampler, eval_args), kind='stable')
+    results = [None] * len(eval_args)
+    for i, result in zip(order, pool.map(evaluate_params, [eval_args[i] for i in order], chunksize=1)):
+        results[i] = result
+    return results
+
+def print_best_observed(sampler: PatgenSampler):
+    best = sampler.best_observed()
+    if best is not None:
+        print("\nBest configuration found:")
+        print_param_set(*best[0], actual_score=best[1])
 
 def print_param_set(weights: Tuple[int, ...], params_ipa: Tuple[int, ...], 
                    params_single: Tuple[int, ...], threshold: int = 5, predicted_score: float = None,
@@ -215,7 +681,7 @@ def print_param_set(weights: Tuple[int, ...], params_ipa: Tuple[int, ...],
             print(f"Prediction error: {error:.3f}")
 
 
-from evaluate_data_mix import sample
+from evaluate_data_mix import corpus_digest, sample
 
 def collect_optimizer_data():
     """Run optimization and save data for later plotting"""
@@ -235,7 +701,8 @@ def collect_optimizer_data():
         
         # Get exploration suggestions and one exploitation suggestion
         explore_sets = sampler.suggest_batch(n_suggestions=5, n_candidates=5000)
-        exploit_sets = sampler.exploit_best_candidates(n_suggestions=1, n_candidates=20000)
+        exploit_sets = sampler.exploit_best_candidates(n_suggestions=1, n_candidates=20000,
+                                                       pending=[p for p, _, _ in explore_sets])
         
         # Get uncertainty for the exploited candidate
         params = exploit_sets[0][0]  # (weights, params_ipa, params_single, threshold)
@@ -255,15 +722,17 @@ def collect_optimizer_data():
             results = pool.map(evaluate_params, eval_args)
         
         # Update model with exploration results
+        observations = []
         for (params, _, _), (good, bad, missed) in zip(explore_sets, results[:5]):
             weights, params_ipa, params_single, threshold = params
             actual_score = sampler.calculate_score(good, bad, missed)
-            sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+            observations.append((weights, params_ipa, params_single, threshold, actual_score, 1.0, (good, bad, missed)))
         
         # Process and store exploitation result
         (good, bad, missed) = results[5]
         actual_score = sampler.calculate_score(good, bad, missed)
-        sampler.update(*params, actual_score)
+        observations.append((*params, actual_score, 1.0, (good, bad, missed)))
+        sampler.update_batch(observations)
         
         # Store data for plotting
         data['iterations'].append(iteration)
@@ -305,7 +774,15 @@ def main_parallel():
     else:
         raise ValueError(f"language {LANGUAGE} unsupported for optimization")
 
-    sampler = PatgenSampler.load_state(f"work/model{LANGUAGE}.pkl")
+    sampler = load_sampler(LANGUAGE)
+    deadline = time.time() + TIME_BUDGET if TIME_BUDGET else None
+    # Exploratory evaluations may be stopped early, exploitation ones always run to the end.
+    stopping = make_stopping_rule(STOPPING_RULE, BAD_PENALTY)
+    # Workers commit every evaluation to the store; those of other optimizer processes
+    # (or of an earlier run that crashed) are taken in before every round.
+    store = EvaluationStore(EVALUATION_DB)
+    corpus = corpus_digest(input_files, LANGUAGE)
+    sampler.sync(store, LANGUAGE, corpus)
 
     if RANDOM_SAMPLE:
         print(f"Randomly sampling {RANDOM_SAMPLE_LEN} parameter sets")
@@ -313,22 +790,29 @@ def main_parallel():
         
         # Prepare parallel evaluation args
         eval_args = [
-            (input_files, weights, params_ipa, params_single, threshold, LANGUAGE, i)
+            (input_files, weights, params_ipa, params_single, threshold, LANGUAGE, i, 1.0, stopping, store)
             for i, ((weights, params_ipa, params_single, threshold), _, _) in enumerate(initial_sets)
         ]
         
         # Run evaluations in parallel
         with Pool() as pool:
-            results = pool.map(evaluate_params, eval_args)
+            results = map_longest_first(pool, sampler, eval_args)
         
         # Process results and update model
-        for (params, pred_score, uncertainty), (good, bad, missed) in zip(initial_sets, results):
+        observations = []
+        for (params, pred_score, uncertainty), result in zip(initial_sets, results):
+            if isinstance(result, StoppedEvaluation):
+                print(f"Stopped early (censored): {EvaluationStopped(result)}")
+                observations.append(sampler.censored_observation(params, result))
+                continue
+            good, bad, missed = result
             weights, params_ipa, params_single, threshold = params
             actual_score = sampler.calculate_score(good, bad, missed)
             print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
             print(f"Actual score: {actual_score:.3f}")
 
-            sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+            observations.append((weights, params_ipa, params_single, threshold, actual_score, 1.0, (good, bad, missed)))
+        sampler.update_batch(observations)
 
 
     if EXPLORATION:
@@ -336,12 +820,14 @@ def main_parallel():
         n_processes = int(os.getenv('RAYON_NUM_THREADS', os.cpu_count()))
         print(f"Running with {n_processes} processes")
         with Pool(processes=n_processes) as pool:
-            for round in range(EXPLORATION_ROUNDS):
+            # With a time budget, rounds go on until the next one is predicted to end after it.
+            for round in itertools.count() if deadline is not None else range(EXPLORATION_ROUNDS):
                 print("="*70)
                 print(f"Round {round}")
 
+                sampler.sync(store, LANGUAGE, corpus)
                 next_sets = sampler.suggest_batch(n_suggestions=SAMPLES_PER_EXPLORATION_ROUND)
-                exploit_sets = sampler.exploit_best_candidates(n_suggestions=1)
+                exploit_sets = sampler.exploit_best_candidates(n_suggestions=1, pending=[p for p, _, _ in next_sets])
                 
                 # Get uncertainty for the exploited candidate
                 exploit_params = exploit_sets[0][0]
@@ -352,26 +838,37 @@ def main_parallel():
                 
                 # Prepare parallel evaluation args
                 eval_args = [
-                    (input_files, weights, params_ipa, params_single, threshold, LANGUAGE, i) 
+                    (input_files, weights, params_ipa, params_single, threshold, LANGUAGE, i,
+                     1.0, stopping if i < SAMPLES_PER_EXPLORATION_ROUND else None, store)
                     for i, ((weights, params_ipa, params_single, threshold), _, _) in enumerate(all_sets)
                 ]
+                if deadline is not None and time.time() + predicted_round_seconds(sampler, eval_args, n_processes) > deadline:
+                    print("Time budget used up")
+                    break
                 
                 # Run evaluations in parallel
-                results = pool.map(evaluate_params, eval_args)
+                results = map_longest_first(pool, sampler, eval_args)
                 
                 # Process results and update model
-                for (params, pred_score, uncertainty), (good, bad, missed) in zip(next_sets, results[:SAMPLES_PER_EXPLORATION_ROUND]):
+                observations = []
+                for (params, pred_score, uncertainty), result in zip(next_sets, results[:SAMPLES_PER_EXPLORATION_ROUND]):
                     weights, params_ipa, params_single, threshold = params
                     print_param_set(weights, params_ipa, params_single, threshold, pred_score, uncertainty)
+                    if isinstance(result, StoppedEvaluation):
+                        print(f"Stopped early (censored): {EvaluationStopped(result)}")
+                        observations.append(sampler.censored_observation(params, result))
+                        continue
+                    good, bad, missed = result
                     actual_score = sampler.calculate_score(good, bad, missed)
                     print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
                     print(f"Actual score: {actual_score:.3f}")
-                    sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+                    observations.append((weights, params_ipa, params_single, threshold, actual_score, 1.0, (good, bad, missed)))
                 
                 # Process and store exploitation result
                 (good, bad, missed) = results[SAMPLES_PER_EXPLORATION_ROUND]
                 actual_score = sampler.calculate_score(good, bad, missed)
-                sampler.update(*exploit_params, actual_score)
+                observations.append((*exploit_params, actual_score, 1.0, (good, bad, missed)))
+                sampler.update_batch(observations)
 
                 # Store data for plotting
                 data['iterations'].append(round)
@@ -395,16 +892,127 @@ def main_parallel():
         for params, pred_score, _ in best_candidates:
             weights, params_ipa, params_single, threshold = params
             print_param_set(weights, params_ipa, params_single, threshold, pred_score)
+            if deadline is not None and time.time() + sampler.predict_seconds([sampler._encode_params(*params)])[0] > deadline:
+                print("Not evaluated, over the time budget")
+                continue
             
             # Evaluate
-            good, bad, missed = sample(input_files, weights, params_ipa, params_single, threshold, LANGUAGE)
+            good, bad, missed = evaluate_params((input_files, weights, params_ipa, params_single, threshold,
+                                                 LANGUAGE, None, 1.0, None, store))
             actual_score = sampler.calculate_score(good, bad, missed)
             print(f"Actual score: {actual_score:.3f}")
             print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
-            sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+            sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
 
 
+    sampler.sync(store, LANGUAGE, corpus)
     sampler.save_state(f"work/model{LANGUAGE}.pkl")
+    print_best_observed(sampler)
+
+def main_async():
+    """Like main_parallel, but a new parameter set is suggested and started as soon as any
+    evaluation finishes, instead of waiting for the slowest one of a round"""
+    TOTAL_EVALUATIONS = 120
+    EXPLOIT_EVERY = 11  # every 11th suggestion exploits, as in a round of main_parallel
+    LIAR = os.getenv("LIAR", "constant")
+
+    lang = os.getenv("TARGET_LANGUAGE")
+    LANGUAGE = lang if lang is not None else "pl"
+
+    data = {
+        'iterations': [],
+        'predictions': [],
+        'uncertainties': [],
+        'actual_scores': []
+    }
+
+    if LANGUAGE == "pl":
+        input_files = ["work/cs.ipa.wlh", "work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/ru.ipa.wlh"]
+    elif LANGUAGE == "uk":
+        input_files = ["work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/ru.ipa.wlh"]
+    else:
+        raise ValueError(f"language {LANGUAGE} unsupported for optimization")
+
+    sampler = load_sampler(LANGUAGE)
+    deadline = time.time() + TIME_BUDGET if TIME_BUDGET else None
+    stopping = make_stopping_rule(STOPPING_RULE, BAD_PENALTY)
+    store = EvaluationStore(EVALUATION_DB)
+    corpus = corpus_digest(input_files, LANGUAGE)
+
+    n_processes = int(os.getenv('RAYON_NUM_THREADS', os.cpu_count()))
+    print(f"Running with {n_processes} processes")
+    # Pool callbacks run in a helper thread, they only hand the results over to this one.
+    finished = queue.Queue()
+    running = {}  # task number -> (params, predicted score, uncertainty, exploitation?)
+
+    with Pool(processes=n_processes) as pool:
+        def submit(task) -> bool:
+            """Start an evaluation, unless it is predicted to end after the deadline"""
+            sampler.sync(store, LANGUAGE, corpus)
+            pending = [params for params, _, _, _ in running.values()]
+            exploit = task % EXPLOIT_EVERY == EXPLOIT_EVERY - 1 and sampler.surrogate.n_observations >= 5
+            if exploit:
+                params = sampler.exploit_best_candidates(n_suggestions=1, pending=pending)[0][0]
+                pred_score, uncertainty = sampler._predict(*params)
+            else:
+                params, pred_score, uncertainty = sampler.suggest_batch(n_suggestions=1, pending=pending, liar=LIAR)[0]
+            if deadline is not None and time.time() + sampler.predict_seconds([sampler._encode_params(*params)])[0] > deadline:
+                return False
+            running[task] = (params, pred_score, uncertainty, exploit)
+            weights, params_ipa, params_single, threshold = params
+            pool.apply_async(evaluate_params,
+                             ((input_files, weights, params_ipa, params_single, threshold, LANGUAGE, task,
+                               1.0, None if exploit else stopping, store),),
+                             callback=lambda result: finished.put((task, result)),
+                             error_callback=lambda e: finished.put((task, e)))
+            return True
+
+        submitted = 0
+        out_of_time = False
+        while submitted < min(n_processes, TOTAL_EVALUATIONS) and not out_of_time:
+            if submit(submitted):
+                submitted += 1
+            else:
+                out_of_time = True
+
+        while running:
+            task, result = finished.get()
+            params, pred_score, uncertainty, exploit = running.pop(task)
+            weights, params_ipa, params_single, threshold = params
+            print("="*70)
+            print(f"Evaluation {task}")
+            print_param_set(weights, params_ipa, params_single, threshold, pred_score, uncertainty)
+            if isinstance(result, BaseException):
+                print(f"Evaluation failed: {result!r}")
+                sampler.record_failure(params)
+            elif isinstance(result, StoppedEvaluation):
+                print(f"Stopped early (censored): {EvaluationStopped(result)}")
+                sampler.update_batch([sampler.censored_observation(params, result)])
+            else:
+                good, bad, missed = result
+                actual_score = sampler.calculate_score(good, bad, missed)
+                print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
+                print(f"Actual score: {actual_score:.3f}")
+                sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
+
+                if exploit:
+                    data['iterations'].append(task)
+                    data['predictions'].append(pred_score)
+                    data['uncertainties'].append(uncertainty)
+                    data['actual_scores'].append(actual_score)
+                    with open(f'optimizer_behavior_{LANGUAGE}.pkl', 'wb') as f:
+                        pickle.dump(data, f)
+
+            if submitted < TOTAL_EVALUATIONS and not out_of_time:
+                if submit(submitted):
+                    submitted += 1
+                else:
+                    out_of_time = True
+                    print("Time budget used up")
+
+    sampler.sync(store, LANGUAGE, corpus)
+    sampler.save_state(f"work/model{LANGUAGE}.pkl")
+    print_best_observed(sampler)
 
 def main_reproducible():
     RANDOM_SAMPLE_LEN = 10
@@ -433,7 +1041,7 @@ def main_reproducible():
     else:
         raise ValueError(f"language {LANGUAGE} unsupported for optimization")
 
-    sampler = PatgenSampler.load_state(f"work/model{LANGUAGE}.pkl")
+    sampler = load_sampler(LANGUAGE)
 
     if RANDOM_SAMPLE:
         print(f"Randomly sampling {RANDOM_SAMPLE_LEN} parameter sets")
@@ -446,7 +1054,7 @@ def main_reproducible():
             actual_score = sampler.calculate_score(good, bad, missed)
             print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
             print(f"Actual score: {actual_score:.3f}")
-            sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+            sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
 
     if EXPLORATION:
         for round in range(EXPLORATION_ROUNDS):
@@ -462,7 +1070,7 @@ def main_reproducible():
                 actual_score = sampler.calculate_score(good, bad, missed)
                 print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
                 print(f"Actual score: {actual_score:.3f}")
-                sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+                sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
 
             # Handle single exploitation set
             exploit_sets = sampler.exploit_best_candidates(n_suggestions=1)
@@ -472,7 +1080,7 @@ def main_reproducible():
             
             good, bad, missed = sample(input_files, weights, params_ipa, params_single, threshold, LANGUAGE)
             actual_score = sampler.calculate_score(good, bad, missed)
-            sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+            sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
             
             # Store data for plotting
             data['iterations'].append(round)
@@ -500,11 +1108,496 @@ def main_reproducible():
             actual_score = sampler.calculate_score(good, bad, missed)
             print(f"Actual score: {actual_score:.3f}")
             print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
-            sampler.update(weights, params_ipa, params_single, threshold, actual_score)
+            sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
+
+    sampler.save_state(f"work/model{LANGUAGE}.pkl")
+
+def task_seed(round: int, slot: int) -> int:
+    """Seed of the evaluation in a slot of a round of main_reproducible_parallel; it only depends
+    on these, not on the worker that runs it or on what that worker ran before"""
+    return int(np.random.SeedSequence([REPRODUCIBLE_SEED, round, slot]).generate_state(1)[0])
+
+def evaluate_round(pool, sampler: PatgenSampler, input_files: List[str], language: str, round: int,
+                   sets) -> list:
+    """Evaluate the parameter sets of a round of main_reproducible_parallel on the pool and update
+    the sampler with the results in the order of sets, whichever finishes first; returns the
+    (good, bad, missed)"""
+    eval_args = [
+        (input_files, weights, params_ipa, params_single, threshold, language, slot, 1.0, None, None,
+         task_seed(round, slot))
+        for slot, (weights, params_ipa, params_single, threshold) in enumerate(sets)
+    ]
+    results = pool.map(evaluate_params, eval_args, chunksize=1)
+    sampler.update_batch([(*params, sampler.calculate_score(*result), 1.0, result)
+                          for params, result in zip(sets, results)])
+    return results
+
+def main_reproducible_parallel(n_processes: Optional[int] = None):
+    """Parallel counterpart of main_reproducible.  Like main_parallel, the exploitation set of a
+    round is picked along with its exploration sets, so runs differ from main_reproducible's;
+    but the saved state and the final configurations only depend on the saved state it starts
+    from, not on the number of processes: rounds are suggested from the sampler alone (no
+    evaluation store, no early stopping, no time budget), every evaluation is seeded by its
+    round and slot, and results are taken in in the order they were suggested."""
+    RANDOM_SAMPLE_LEN = 10
+    EXPLORATION_ROUNDS = 10
+    SAMPLES_PER_EXPLORATION_ROUND = 10
+
+    lang = os.getenv("TARGET_LANGUAGE")
+    LANGUAGE = lang if lang is not None else "pl"
+    RANDOM_SAMPLE = True
+    EXPLORATION = True
+    EXPLOITATION = True
+
+    data = {
+        'iterations': [],
+        'predictions': [],
+        'uncertainties': [],
+        'actual_scores': []
+    }
+
+    # Set up input files based on language
+    if LANGUAGE == "pl":
+        input_files = ["work/cs.ipa.wlh", "work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/ru.ipa.wlh"]
+    elif LANGUAGE == "uk":
+        input_files = ["work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/ru.ipa.wlh"]
+    else:
+        raise ValueError(f"language {LANGUAGE} unsupported for optimization")
+
+    sampler = load_sampler(LANGUAGE)
+
+    n_processes = n_processes or int(os.getenv('RAYON_NUM_THREADS', os.cpu_count()))
+    print(f"Running with {n_processes} processes")
+    with Pool(processes=n_processes) as pool:
+        if RANDOM_SAMPLE:
+            print(f"Randomly sampling {RANDOM_SAMPLE_LEN} parameter sets")
+            initial_sets = [params for params, _, _ in sampler.suggest_batch(n_suggestions=RANDOM_SAMPLE_LEN)]
+            for good, bad, missed in evaluate_round(pool, sampler, input_files, LANGUAGE, 0, initial_sets):
+                print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
+                print(f"Actual score: {sampler.calculate_score(good, bad, missed):.3f}")
+
+        if EXPLORATION:
+            for round in range(EXPLORATION_ROUNDS):
+                print("="*70)
+                print(f"Round {round}")
+
+                # Exploration sets and a single exploitation set, evaluated together
+                next_sets = sampler.suggest_batch(n_suggestions=SAMPLES_PER_EXPLORATION_ROUND)
+                exploit_params = sampler.exploit_best_candidates(n_suggestions=1,
+                                                                 pending=[p for p, _, _ in next_sets])[0][0]
+                pred_score, uncertainty = sampler._predict(*exploit_params)
+                all_sets = next_sets + [(exploit_params, pred_score, uncertainty)]
+
+                results = evaluate_round(pool, sampler, input_files, LANGUAGE, round + 1,
+                                         [params for params, _, _ in all_sets])
+                for (params, set_score, set_uncertainty), (good, bad, missed) in zip(next_sets, results):
+                    weights, params_ipa, params_single, threshold = params
+                    print_param_set(weights, params_ipa, params_single, threshold, set_score, set_uncertainty)
+                    print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
+                    print(f"Actual score: {sampler.calculate_score(good, bad, missed):.3f}")
+                actual_score = sampler.calculate_score(*results[-1])
+
+                # Store data for plotting
+                data['iterations'].append(round)
+                data['predictions'].append(pred_score)
+                data['uncertainties'].append(uncertainty)
+                data['actual_scores'].append(actual_score)
+
+                print(f"\nExploitation - predicted: {pred_score:.3f} ± {uncertainty:.3f}, actual: {actual_score:.3f}")
+
+                # Save data after each round
+                with open(f'optimizer_behavior_{LANGUAGE}.pkl', 'wb') as f:
+                    pickle.dump(data, f)
+
+        if EXPLOITATION:
+            print("="*70)
+            print("!"*70)
+            print("="*70)
+            print("\nFinal exploitation phase - best predicted configurations:")
+            best_candidates = sampler.exploit_best_candidates(n_suggestions=5)
+            results = evaluate_round(pool, sampler, input_files, LANGUAGE, EXPLORATION_ROUNDS + 1,
+                                     [params for params, _, _ in best_candidates])
+            for (params, pred_score, _), (good, bad, missed) in zip(best_candidates, results):
+                weights, params_ipa, params_single, threshold = params
+                print_param_set(weights, params_ipa, params_single, threshold, pred_score)
+                print(f"Actual score: {sampler.calculate_score(good, bad, missed):.3f}")
+                print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
+
+    sampler.save_state(f"work/model{LANGUAGE}.pkl")
+
+def successive_halving(sampler: PatgenSampler, pool, input_files: List[str], language: str,
+                       n_candidates: int, eta: int = HALVING_ETA, rungs: int = HALVING_RUNGS,
+                       store: EvaluationStore = None):
+    """Evaluate n_candidates suggestions on a 1/eta**rungs subsample of the corpora, the best
+    1/eta of them on an eta times larger one, and so on up to the full corpora.  Every
+    evaluation updates the sampler with its fidelity.  Returns the full fidelity
+    [(params, predicted score, uncertainty, (good, bad, missed) or StoppedEvaluation)]"""
+    candidates = sampler.suggest_batch(n_suggestions=n_candidates)
+    stopping = make_stopping_rule(STOPPING_RULE, BAD_PENALTY)
+    for rung in range(rungs, -1, -1):
+        fidelity = 1.0 / eta ** rung
+        print(f"Rung fidelity {fidelity:.3f}: {len(candidates)} candidates")
+        eval_args = [
+            (input_files, weights, params_ipa, params_single, threshold, language, i, fidelity, stopping, store)
+            for i, ((weights, params_ipa, params_single, threshold), _, _) in enumerate(candidates)
+        ]
+        results = map_longest_first(pool, sampler, eval_args)
+        observations, scores = [], []
+        for (params, _, _), result in zip(candidates, results):
+            if isinstance(result, StoppedEvaluation):
+                observations.append(sampler.censored_observation(params, result, fidelity))
+                scores.append(-np.inf)  # never promoted
+            else:
+                scores.append(sampler.calculate_score(*result))
+                observations.append((*params, scores[-1], fidelity, result))
+        sampler.update_batch(observations)
+        if rung == 0:
+            return [(params, pred_score, uncertainty, result)
+                    for (params, pred_score, uncertainty), result in zip(candidates, results)]
+        best = np.argsort(scores)[::-1][:max(1, len(candidates) // eta)]
+        candidates = [candidates[i] for i in best if scores[i] > -np.inf]
+        if not candidates:
+            return []
+
+def main_hyperband():
+    """Like main_parallel, but candidates are screened on subsamples of the corpora first
+    and only the most promising ones are evaluated in full"""
+    ROUNDS = 10
+    CANDIDATES_PER_ROUND = 27
+
+    lang = os.getenv("TARGET_LANGUAGE")
+    LANGUAGE = lang if lang is not None else "pl"
+
+    if LANGUAGE == "pl":
+        input_files = ["work/cs.ipa.wlh", "work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/ru.ipa.wlh"]
+    elif LANGUAGE == "uk":
+        input_files = ["work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/ru.ipa.wlh"]
+    else:
+        raise ValueError(f"language {LANGUAGE} unsupported for optimization")
+
+    sampler = load_sampler(LANGUAGE)
+    store = EvaluationStore(EVALUATION_DB)
+    corpus = corpus_digest(input_files, LANGUAGE)
+
+    n_processes = int(os.getenv('RAYON_NUM_THREADS', os.cpu_count()))
+    print(f"Running with {n_processes} processes")
+    with Pool(processes=n_processes) as pool:
+        for round in range(ROUNDS):
+            print("="*70)
+            print(f"Round {round}")
+            sampler.sync(store, LANGUAGE, corpus)
+            for params, pred_score, uncertainty, result in successive_halving(
+                    sampler, pool, input_files, LANGUAGE, CANDIDATES_PER_ROUND, store=store):
+                weights, params_ipa, params_single, threshold = params
+                print_param_set(weights, params_ipa, params_single, threshold, pred_score, uncertainty)
+                if isinstance(result, StoppedEvaluation):
+                    print(f"Stopped early (censored): {EvaluationStopped(result)}")
+                    continue
+                good, bad, missed = result
+                print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
+                print(f"Actual score: {sampler.calculate_score(good, bad, missed):.3f}")
+            sampler.sync(store, LANGUAGE, corpus)
+            sampler.save_state(f"work/model{LANGUAGE}.pkl")
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+def resolve_authkey(address: str, authkey: Optional[bytes]) -> bytes:
+    """authkey, or LOOPBACK_AUTHKEY if there is none and address is a loopback one"""
+    if authkey:
+        return authkey
+    host, _ = parse_address(address)
+    try:
+        loopback = bool(host) and ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        loopback = False
+    if not loopback:
+        raise ValueError(f"{address} is not a loopback address, set COORDINATOR_AUTHKEY to a secret key shared "
+                         f"by the coordinator and the workers")
+    return LOOPBACK_AUTHKEY
+
+
+class WorkQueue:
+    """Evaluations of the coordinator, handed out to the workers of a QueueManager.  A task whose
+    worker misses its heartbeats for heartbeat_timeout seconds is handed out again; the first
+    result of a task counts."""
+    def __init__(self, heartbeat_timeout: Optional[float] = None):
+        self.heartbeat_timeout = HEARTBEAT_TIMEOUT if heartbeat_timeout is None else heartbeat_timeout
+        self.lock = threading.Lock()
+        self.tasks = {}  # task -> evaluate_params args, until it is finished
+        self.pending = collections.deque()
+        self.assigned = {}  # task -> (worker, time of its last heartbeat)
+        self.finished = queue.Queue()  # (task, result, timings, worker)
+        self.is_closed = False
+
+    # Coordinator side
+
+    def submit(self, task, args):
+        with self.lock:
+            self.tasks[task] = args
+            self.pending.append(task)
+
+    def get_result(self, timeout: Optional[float] = None):
+        """(task, result, timings, worker) of the next finished task; the result is (good, bad, missed),
+        a StoppedEvaluation or the exception the evaluation raised"""
+        return self.finished.get(timeout=timeout)
+
+    def close(self):
+        """Let the workers go once they ask for another task"""
+        with self.lock:
+            self.is_closed = True
+
+    # Worker side
+
+    def get_task(self, worker: str):
+        """(task, evaluate_params args) for the worker, None if there is none right now"""
+        with self.lock:
+            self._reassign_stale()
+            if not self.pending:
+                return None
+            task = self.pending.popleft()
+            self.assigned[task] = (worker, time.time())
+            return task, self.tasks[task]
+
+    def heartbeat(self, worker: str, task) -> bool:
+        """Note that the worker is still on the task; False if it was handed out again or finished"""
+        with self.lock:
+            if self.assigned.get(task, (None,))[0] != worker:
+                return False
+            self.assigned[task] = (worker, time.time())
+            return True
+
+    def put_result(self, worker: str, task, result, timings):
+        with self.lock:
+            if task not in self.tasks:
+                return  # finished by another worker it was handed out to
+            del self.tasks[task]
+            self.assigned.pop(task, None)
+            if task in self.pending:
+                self.pending.remove(task)
+            self.finished.put((task, result, timings, worker))
+
+    def closed(self) -> bool:
+        return self.is_closed
+
+    def _reassign_stale(self):
+        now = time.time()
+        for task, (worker, seen) in list(self.assigned.items()):
+            if now - seen > self.heartbeat_timeout:
+                print(f"No heartbeat from {worker} for {now - seen:.0f} s, handing out task {task} again")
+                del self.assigned[task]
+                self.pending.appendleft(task)
+
+
+class QueueManager(BaseManager):
+    """Serves the coordinator's WorkQueue to the workers"""
+
+QueueManager.register('work_queue')
+
+
+def serve_work_queue(work_queue: WorkQueue, address: str = COORDINATOR_ADDRESS,
+                     authkey: Optional[bytes] = COORDINATOR_AUTHKEY):
+    """Serve work_queue on address in a thread of this process; stop it with server.stop_event.set()"""
+    authkey = resolve_authkey(address, authkey)
+    QueueManager.register('work_queue', callable=lambda: work_queue)
+    server = QueueManager(address=parse_address(address), authkey=authkey).get_server()
+    threading.Thread(target=_serve_until_stopped, args=(server,), daemon=True).start()
+    return server
+
+def _serve_until_stopped(server):
+    try:
+        server.serve_forever()
+    except SystemExit:
+        pass  # how serve_forever ends once stop_event is set
 
+
+def _send_heartbeats(work_queue, worker: str, task, stop: threading.Event):
+    while not stop.wait(HEARTBEAT_SECONDS):
+        try:
+            work_queue.heartbeat(worker, task)
+        except (EOFError, OSError):
+            return  # the coordinator is gone, the main loop finds out too
+
+def run_worker(address: str = COORDINATOR_ADDRESS, authkey: Optional[bytes] = COORDINATOR_AUTHKEY):
+    """Evaluate the tasks of a main_distributed coordinator until it closes; needs the same
+    work/ files as the coordinator, relative to the current directory"""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    manager = QueueManager(address=parse_address(address), authkey=resolve_authkey(address, authkey))
+    give_up = time.time() + WORKER_CONNECT_SECONDS
+    while True:
+        try:
+            manager.connect()
+            break
+        except ConnectionRefusedError:
+            if time.time() > give_up:
+                raise
+            time.sleep(WORKER_POLL_SECONDS)
+    work_queue = manager.work_queue()
+    print(f"Worker {worker} connected to {address}")
+    try:
+        while True:
+            assignment = work_queue.get_task(worker)
+            if assignment is None:
+                if work_queue.closed():
+                    break
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+            task, args = assignment
+            stop = threading.Event()
+            heartbeats = threading.Thread(target=_send_heartbeats, args=(work_queue, worker, task, stop), daemon=True)
+            heartbeats.start()
+            try:
+                result, timings = evaluate_params_timed(args)
+            except Exception as e:
+                # Not the exception itself, the coordinator may not be able to unpickle it
+                result, timings = RuntimeError(f"{type(e).__name__}: {e}"), None
+            finally:
+                stop.set()
+                heartbeats.join()
+            work_queue.put_result(worker, task, result, timings)
+    except (EOFError, OSError):
+        print(f"Worker {worker} lost the coordinator")
+
+def run_workers(processes: int, address: str = COORDINATOR_ADDRESS, authkey: Optional[bytes] = COORDINATOR_AUTHKEY):
+    authkey = resolve_authkey(address, authkey)
+    workers = [Process(target=run_worker, args=(address, authkey)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def main_distributed(total_evaluations: int = 120, in_flight: Optional[int] = None,
+                     address: str = COORDINATOR_ADDRESS, authkey: Optional[bytes] = COORDINATOR_AUTHKEY):
+    """Like main_async, but the evaluations run on workers on any number of hosts, which connect
+    to this coordinator: python optimize_params.py worker [host:port] [processes]"""
+    TOTAL_EVALUATIONS = total_evaluations
+    EXPLOIT_EVERY = 11
+    LIAR = os.getenv("LIAR", "constant")
+    # Tasks queued or running at any time, so that no worker waits for a suggestion
+    IN_FLIGHT = in_flight or int(os.getenv('COORDINATOR_IN_FLIGHT', 2 * os.cpu_count()))
+    authkey = resolve_authkey(address, authkey)
+
+    lang = os.getenv("TARGET_LANGUAGE")
+    LANGUAGE = lang if lang is not None else "pl"
+
+    if LANGUAGE == "pl":
+        input_files = ["work/cs.ipa.wlh", "work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/ru.ipa.wlh"]
+    elif LANGUAGE == "uk":
+        input_files = ["work/pl.ipa.wlh", "work/sk.ipa.wlh", "work/uk.ipa.wlh", "work/ru.ipa.wlh"]
+    else:
+        raise ValueError(f"language {LANGUAGE} unsupported for optimization")
+
+    sampler = load_sampler(LANGUAGE)
+    stopping = make_stopping_rule(STOPPING_RULE, BAD_PENALTY)
+    # Workers may not see the coordinator's disk, so it commits their results itself.
+    store = EvaluationStore(EVALUATION_DB)
+    corpus = corpus_digest(input_files, LANGUAGE)
+
+    work_queue = WorkQueue()
+    server = serve_work_queue(work_queue, address, authkey)
+    print(f"Coordinating at {address}, {IN_FLIGHT} tasks in flight")
+    running = {}  # task number -> (params, predicted score, uncertainty, exploitation?)
+
+    def submit(task):
+        sampler.sync(store, LANGUAGE, corpus)
+        pending = [params for params, _, _, _ in running.values()]
+        exploit = task % EXPLOIT_EVERY == EXPLOIT_EVERY - 1 and sampler.surrogate.n_observations >= 5
+        if exploit:
+            params = sampler.exploit_best_candidates(n_suggestions=1, pending=pending)[0][0]
+            pred_score, uncertainty = sampler._predict(*params)
+        else:
+            params, pred_score, uncertainty = sampler.suggest_batch(n_suggestions=1, pending=pending, liar=LIAR)[0]
+        running[task] = (params, pred_score, uncertainty, exploit)
+        weights, params_ipa, params_single, threshold = params
+        work_queue.submit(task, (input_files, weights, params_ipa, params_single, threshold, LANGUAGE, task,
+                                 1.0, None if exploit else stopping))
+
+    try:
+        submitted = 0
+        while submitted < min(IN_FLIGHT, TOTAL_EVALUATIONS):
+            submit(submitted)
+            submitted += 1
+
+        while running:
+            task, result, timings, worker = work_queue.get_result()
+            params, pred_score, uncertainty, exploit = running.pop(task)
+            weights, params_ipa, params_single, threshold = params
+            print("="*70)
+            print(f"Evaluation {task} on {worker}")
+            print_param_set(weights, params_ipa, params_single, threshold, pred_score, uncertainty)
+            if isinstance(result, BaseException):
+                print(f"Evaluation failed: {result!r}")
+                sampler.record_failure(params)
+            elif isinstance(result, StoppedEvaluation):
+                print(f"Stopped early (censored): {EvaluationStopped(result)}")
+                store.add(LANGUAGE, corpus, params, 1.0, result, None, timings)
+                sampler.update_batch([sampler.censored_observation(params, result)])
+            else:
+                good, bad, missed = result
+                actual_score = sampler.calculate_score(good, bad, missed)
+                print(f"Evaluation: good={good}, bad={bad}, missed={missed}")
+                print(f"Actual score: {actual_score:.3f}")
+                store.add(LANGUAGE, corpus, params, 1.0, result, actual_score, timings)
+                sampler.update(weights, params_ipa, params_single, threshold, actual_score, counts=(good, bad, missed))
+
+            if submitted < TOTAL_EVALUATIONS:
+                submit(submitted)
+                submitted += 1
+    finally:
+        work_queue.close()
+        # Idle workers ask again within WORKER_POLL_SECONDS and are told to stop.
+        time.sleep(2 * WORKER_POLL_SECONDS)
+        server.stop_event.set()
+
+    sampler.sync(store, LANGUAGE, corpus)
     sampler.save_state(f"work/model{LANGUAGE}.pkl")
+    print_best_observed(sampler)
+
+def compare_saved_surrogates(filenames: List[str]):
+    """Cross-validate every surrogate backend on the pooled observations of saved states"""
+    X, y = [], []
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+        X.extend(list(x) + [1.0] if len(x) < N_FEATURES else x for x in state['X'])
+        y.extend(state['y'])
+    print(f"{len(y)} observations from {', '.join(filenames)}")
+    results = compare_surrogates(np.array(X, dtype=float), np.array(y, dtype=float), SURROGATES)
+    print(f"{'surrogate':10} {'rmse':>8} {'nlpd':>8} {'fit s':>8}")
+    for name, (rmse, nlpd, fit_time) in results.items():
+        print(f"{name:10} {rmse:8.4f} {nlpd:8.3f} {fit_time:8.2f}")
 
 if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 2 and sys.argv[1] == 'compare-surrogates':
+        # python optimize_params.py compare-surrogates work/modeluk.pkl [work/modelpl.pkl ...]
+        compare_saved_surrogates(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'coordinator':
+        # python optimize_params.py coordinator, with COORDINATOR_ADDRESS=0.0.0.0:port and
+        # COORDINATOR_AUTHKEY for remote workers
+        main_distributed()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'async':
+        # python optimize_params.py async, with LIAR and TIME_BUDGET as in main_async
+        main_async()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'hyperband':
+        # python optimize_params.py hyperband, successive halving over subsampled corpora
+        main_hyperband()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        import argparse
+        parser = argparse.ArgumentParser(prog=f"{sys.argv[0]} worker",
+                                         description="Evaluate the tasks of a main_distributed coordinator")
+        parser.add_argument('address', nargs='?', default=COORDINATOR_ADDRESS, help="host:port of the coordinator")
+        parser.add_argument('processes', nargs='?', type=int, default=1, help="evaluations to run at once")
+        parser.add_argument('--authkey', default=None,
+                            help="secret key of the coordinator (default: COORDINATOR_AUTHKEY)")
+        args = parser.parse_args(sys.argv[2:])
+        run_workers(args.processes, args.address, args.authkey.encode() if args.authkey else COORDINATOR_AUTHKEY)
+        sys.exit(0)
     # To collect optimizer data:
     #collect_optimizer_data()
     main_reproducible()
@@ -0,0 +1,169 @@
+# Compiled, memory-mappable form of the pattern trie used by hyph.Hyphenator.
+#
+# The trie is stored as flat arrays; nodes are numbered in breadth-first order
+# with the root at 0:
+#
+#   edge_start  u32[n_nodes + 1]  edges of node i are edge_start[i]..edge_start[i+1]
+#   edge_char   u32[n_edges]      code point of each edge, sorted within a node
+#   edge_child  u32[n_edges]      target node of each edge
+#   point_start u32[n_nodes + 1]  points of node i are point_start[i]..point_start[i+1],
+#                                 an empty range means no pattern ends at node i
+#   points      u8[n_points]
+#
+# The arrays are written after a small header in native byte order, so a cache
+# file is only meant to be read on the machine that wrote it.
+
+import glob
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b'HYPT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('=4sIIII')  # magic, version, n_nodes, n_edges, n_points
+CACHE_SUFFIX = '.trie'
+
+
+class CompiledTrie:
+    def __init__(self, edge_start, edge_char, edge_child, point_start, points, buffer=None):
+        self.edge_start = edge_start
+        self.edge_char = edge_char
+        self.edge_child = edge_child
+        self.point_start = point_start
+        self.points_data = points
+        self.n_nodes = len(edge_start) - 1
+        # Keeps the mmap alive for as long as the views above are in use.
+        self._buffer = buffer
+        # Per-node {char: child} dicts and point tuples, materialized on first visit.
+        self._children: List[Optional[Dict[str, int]]] = [None] * self.n_nodes
+        self._points: List[Optional[tuple]] = [None] * self.n_nodes
+
+    @classmethod
+    def from_tree(cls, tree: dict) -> 'CompiledTrie':
+        """Flatten a dict-of-dicts tree (leaf points stored under None) breadth-first"""
+        edge_start = array('I', [0])
+        edge_char = array('I')
+        edge_child = array('I')
+        point_start = array('I', [0])
+        points = array('B')
+
+        queue = deque([tree])
+        next_id = 1
+        while queue:
+            t = queue.popleft()
+            for c in sorted(k for k in t if k is not None):
+                edge_char.append(ord(c))
+                edge_child.append(next_id)
+                queue.append(t[c])
+                next_id += 1
+            edge_start.append(len(edge_char))
+            if None in t:
+                points.extend(t[None])
+            point_start.append(len(points))
+        return cls(edge_start, edge_char, edge_child, point_start, points)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompiledTrie':
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_nodes, n_edges, n_points = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            buf.close()
+            raise ValueError(f"{path} is not a compiled pattern trie (version {FORMAT_VERSION})")
+        view = memoryview(buf)
+        offset = HEADER.size
+
+        def take(n, fmt, size):
+            nonlocal offset
+            part = view[offset:offset + n * size].cast(fmt)
+            offset += n * size
+            return part
+
+        edge_start = take(n_nodes + 1, 'I', 4)
+        edge_char = take(n_edges, 'I', 4)
+        edge_child = take(n_edges, 'I', 4)
+        point_start = take(n_nodes + 1, 'I', 4)
+        points = take(n_points, 'B', 1)
+        return cls(edge_start, edge_char, edge_child, point_start, points, buffer=buf)
+
+    def save(self, path: str):
+        """Write the trie atomically, so concurrent readers never see a partial file"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.n_nodes,
+                                    len(self.edge_char), len(self.points_data)))
+                for part in (self.edge_start, self.edge_char, self.edge_child,
+                             self.point_start, self.points_data):
+                    f.write(part)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def children(self, node: int) -> Dict[str, int]:
+        kids = self._children[node]
+        if kids is None:
+            lo, hi = self.edge_start[node], self.edge_start[node + 1]
+            kids = {chr(self.edge_char[e]): self.edge_child[e] for e in range(lo, hi)}
+            self._children[node] = kids
+        return kids
+
+    def points(self, node: int) -> Optional[tuple]:
+        """Points of the pattern ending at node, or None if no pattern ends there"""
+        p = self._points[node]
+        if p is None:
+            lo, hi = self.point_start[node], self.point_start[node + 1]
+            if lo == hi:
+                return None
+            p = tuple(self.points_data[lo:hi])
+            self._points[node] = p
+        return p
+
+    def patterns(self) -> Iterator[Tuple[str, tuple]]:
+        """Yield (chars, points) of every pattern, in breadth-first order"""
+        prefix = [''] * self.n_nodes
+        for node in range(self.n_nodes):
+            p = self.points(node)
+            if p is not None:
+                yield prefix[node], p
+            for e in range(self.edge_start[node], self.edge_start[node + 1]):
+                prefix[self.edge_child[e]] = prefix[node] + chr(self.edge_char[e])
+
+
+def cache_path_for(pattern_file: str, content: bytes) -> str:
+    digest = hashlib.sha1(content).hexdigest()[:16]
+    return f"{pattern_file}.{sys.byteorder[0]}{digest}{CACHE_SUFFIX}"
+
+
+def load_cached(pattern_file: str, build_tree: Callable[[str], dict]) -> CompiledTrie:
+    """Load the compiled trie for pattern_file, compiling and caching it on a miss.
+
+    The cache lives next to the pattern file and is named after a hash of its
+    content, so an edited pattern file is never served a stale trie.
+    """
+    with open(pattern_file, 'rb') as f:
+        content = f.read()
+    path = cache_path_for(pattern_file, content)
+    try:
+        return CompiledTrie.load(path)
+    except (OSError, ValueError):
+        pass
+
+    trie = CompiledTrie.from_tree(build_tree(content.decode('utf-8')))
+    try:
+        trie.save(path)
+        # Drop caches of earlier versions of the same pattern file.
+        for stale in glob.glob(glob.escape(pattern_file) + '.*' + CACHE_SUFFIX):
+            if stale != path:
+                os.remove(stale)
+    except OSError:
+        pass  # read-only location, just use the in-memory trie
+    return trie
@@ -0,0 +1,441 @@
+# In-process reimplementation of patgen's pattern generation, as driven by make-full-pattern.sh.
+#
+# The word list is kept in memory as a zero-padded matrix of code points, and
+# each patgen pass (one pattern length and dot position) collects the counts of
+# all candidate patterns for the whole word list at once with vectorized n-gram
+# hashing, instead of re-reading the dictionary from disk.
+#
+# Positions follow hyph.Hyphenator: a word of n letters is stored as
+# '.' + word + '.', and dot q is the gap in front of character q of that string,
+# so the hyphen after the k-th letter (0-based) is dot k + 2.
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+
+EDGE = ord('.')
+# patgen's dot marks; a computed odd hyphenation value adds 1 to the mark read from the file.
+NO_HYF, ERR_HYF, IS_HYF, FOUND_HYF = 0, 1, 2, 3
+HYF_MARKS = {'.': ERR_HYF, '-': IS_HYF, '*': FOUND_HYF}
+# patgen's max_val: the value given to "hopeless" candidates, which only serve to keep
+# longer patterns containing them from being considered during the rest of the level.
+MAX_VAL = 10
+HASH_BASE = np.uint64(1000003)
+
+
+class LevelParams(NamedTuple):
+    hyph_start: int
+    hyph_finish: int
+    pat_start: int
+    pat_finish: int
+    good_wt: int
+    bad_wt: int
+    thresh: int
+
+
+class Translate(NamedTuple):
+    left_min: int
+    right_min: int
+    # every representation of a letter -> its first representation; None accepts any letter
+    letters: Optional[Dict[str, str]]
+
+
+def read_parameters(params_file: str) -> List[LevelParams]:
+    """Parameters of each patgen run from a .par file, as make-full-pattern.sh sources them"""
+    values = {}
+    with open(params_file, 'r', encoding='utf-8') as f:
+        for name, index, value in re.findall(r"^\s*(\w+)\[(\d+)\]='([^']*)'", f.read(), re.M):
+            values[(name, int(index))] = [int(v) for v in value.split()]
+    # The script runs patgen once per good_bad_thres entry.
+    n_runs = sum(1 for name, _ in values if name == 'good_bad_thres')
+    return [LevelParams(*values[('hyph_start_finish', i)], *values[('pat_start_finish', i)],
+                        *values[('good_bad_thres', i)])
+            for i in range(1, n_runs + 1)]
+
+
+def read_translate(translate_file: str) -> Translate:
+    with open(translate_file, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    # Columns 1-2 and 3-4 of the first line hold left_hyphen_min and right_hyphen_min.
+    try:
+        left_min, right_min = int(lines[0][0:2]), int(lines[0][2:4])
+    except ValueError:
+        left_min, right_min = 2, 3  # patgen's defaults
+    letters = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        # The first character is the delimiter, a double delimiter ends the line.
+        reps = []
+        for rep in line[1:].split(line[0]):
+            if not rep:
+                break
+            reps.append(rep)
+        for rep in reps:
+            if len(rep) != 1:
+                raise ValueError(f"multi-character letter {rep!r} in {translate_file} is not supported")
+            letters[rep] = reps[0]
+    return Translate(left_min, right_min, letters)
+
+
+def parse_pattern(pattern: str) -> Tuple[Tuple[int, ...], Dict[int, int]]:
+    """'a1bc3d4' -> code points of 'abcd' and the nonzero values {dot: value}"""
+    codes = []
+    ops = {}
+    for c in pattern:
+        if c.isdigit():
+            ops[len(codes)] = int(c)
+        else:
+            codes.append(ord(c))
+    return tuple(codes), {t: v for t, v in ops.items() if v}
+
+
+class Dictionary:
+    """A patgen word list in memory.
+
+    codes:   (N, T) code points of '.' + word + '.', zero-padded
+    dots:    (N, T + 1) marks from the file (NO_HYF, ERR_HYF, IS_HYF or FOUND_HYF)
+    weights: (N, T + 1) weight of every dot
+    lengths: (N,) letters per word
+    """
+    def __init__(self, codes: np.ndarray, dots: np.ndarray, weights: np.ndarray, lengths: np.ndarray):
+        self.codes = codes
+        self.dots = dots
+        self.weights = weights
+        self.lengths = lengths
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> 'Dictionary':
+        # As in patgen, a digit in front of the first letter sets the weight of this and
+        # all following words, any other digit the weight of the dots after it.
+        words = []
+        word_wt = 1
+        for line in lines:
+            fields = line.split()
+            if not fields:
+                continue
+            letters = []
+            marks = {}
+            dot_wts = [word_wt, word_wt]
+            dot_wt = word_wt
+            for c in fields[0]:
+                if '0' <= c <= '9':
+                    if not letters:
+                        word_wt = dot_wt = int(c)
+                        dot_wts = [word_wt, word_wt]
+                    else:
+                        dot_wt = int(c)
+                elif c in HYF_MARKS:
+                    marks[len(letters) + 1] = HYF_MARKS[c]
+                else:
+                    letters.append(c)
+                    dot_wts.append(dot_wt)
+            if letters:
+                words.append((''.join(letters), marks, dot_wts))
+
+        width = max((len(w) for w, _, _ in words), default=0) + 2
+        codes = np.zeros((len(words), width), dtype=np.uint32)
+        dots = np.zeros((len(words), width + 1), dtype=np.int8)
+        weights = np.zeros((len(words), width + 1), dtype=np.int64)
+        lengths = np.zeros(len(words), dtype=np.int64)
+        for r, (word, marks, dot_wts) in enumerate(words):
+            n = len(word)
+            lengths[r] = n
+            codes[r, :n + 2] = np.frombuffer(('.' + word + '.').encode('utf-32-le'), dtype='<u4')
+            weights[r, :n + 2] = dot_wts
+            for q, mark in marks.items():
+                dots[r, q] = mark
+        return cls(codes, dots, weights, lengths)
+
+    @classmethod
+    def from_file(cls, filename: str) -> 'Dictionary':
+        with open(filename, 'r', encoding='utf-8') as f:
+            return cls.from_lines(f)
+
+    @classmethod
+    def concat(cls, parts: Sequence[Tuple['Dictionary', int]]) -> 'Dictionary':
+        """Join unweighted word lists, giving every word of a part that part's weight"""
+        parts = [(d, w) for d, w in parts if len(d.lengths)]
+        if not parts:
+            return cls.from_lines([])
+        width = max(d.codes.shape[1] for d, _ in parts)
+
+        def pad(a, cols):
+            return np.pad(a, ((0, 0), (0, cols - a.shape[1])))
+
+        return cls(np.concatenate([pad(d.codes, width) for d, _ in parts]),
+                   np.concatenate([pad(d.dots, width + 1) for d, _ in parts]),
+                   np.concatenate([pad(d.weights, width + 1) * w for d, w in parts]),
+                   np.concatenate([d.lengths for d, _ in parts]))
+
+    def translated(self, translate: Translate) -> 'Dictionary':
+        """Map every letter to its first representation in the translate file"""
+        if translate.letters is None:
+            return self
+        present = np.unique(self.codes)
+        mapping = {}
+        for code in present:
+            if code in (0, EDGE):
+                continue
+            c = chr(code)
+            if c not in translate.letters:
+                raise ValueError(f"bad character {c!r} in dictionary, not in translate file")
+            if translate.letters[c] != c:
+                mapping[code] = ord(translate.letters[c])
+        if not mapping:
+            return self
+        codes = self.codes.copy()
+        for old, new in mapping.items():
+            codes[self.codes == old] = new
+        return Dictionary(codes, self.dots, self.weights, self.lengths)
+
+
+def _hash_rows(rows: np.ndarray) -> np.ndarray:
+    h = np.zeros(len(rows), dtype=np.uint64)
+    for k in range(rows.shape[1]):
+        h = h * HASH_BASE + rows[:, k].astype(np.uint64)
+    return h
+
+
+def _window_hashes(codes: np.ndarray, length: int) -> np.ndarray:
+    """h[r, i] is the hash of codes[r, i:i + length]"""
+    codes = codes.astype(np.uint64)
+    h = codes[:, :codes.shape[1] - length + 1].copy()
+    for k in range(1, length):
+        h = h * HASH_BASE + codes[:, k:codes.shape[1] - length + 1 + k]
+    return h
+
+
+class _CodeSet:
+    """Exact set of equal-length code point sequences with vectorized membership tests"""
+    def __init__(self):
+        self.items = set()
+        self._table = None
+
+    def add(self, codes: Tuple[int, ...]):
+        if codes not in self.items:
+            self.items.add(codes)
+            self._table = None
+
+    def contains(self, rows: np.ndarray) -> np.ndarray:
+        if not self.items or not len(rows):
+            return np.zeros(len(rows), dtype=bool)
+        if self._table is None:
+            items = np.array(sorted(self.items), dtype=np.uint32)
+            hashes = _hash_rows(items)
+            order = np.argsort(hashes)
+            self._table = (hashes[order], items[order], bool((np.diff(hashes[order]) == 0).any()))
+        hashes, items, collisions = self._table
+        if collisions:
+            return np.array([tuple(int(c) for c in row) in self.items for row in rows], dtype=bool)
+        h = _hash_rows(rows)
+        idx = np.minimum(np.searchsorted(hashes, h), len(hashes) - 1)
+        hit = hashes[idx] == h
+        hit[hit] = (items[idx[hit]] == rows[hit]).all(axis=1)
+        return hit
+
+
+def dot_order(pat_len: int) -> List[int]:
+    """Dot positions of a pattern length in the order patgen tries them, middle first"""
+    order = []
+    pat_dot = pat_len // 2
+    dot1 = pat_dot * 2
+    while True:
+        pat_dot = dot1 - pat_dot
+        dot1 = pat_len * 2 - dot1 - 1
+        order.append(pat_dot)
+        if pat_dot == pat_len:
+            return order
+
+
+class PatternTrainer:
+    """patgen's pattern generation over an in-memory Dictionary"""
+    def __init__(self, dictionary: Dictionary, left_min: int, right_min: int, patterns: Iterable[str] = ()):
+        self.dictionary = dictionary
+        self.left_min = left_min
+        self.right_min = right_min
+        # pattern code points -> {dot: value}
+        self.ops: Dict[Tuple[int, ...], Dict[int, int]] = {}
+        for pattern in patterns:
+            codes, ops = parse_pattern(pattern)
+            if ops:
+                self.ops.setdefault(codes, {}).update(ops)
+        # Hyphenation values of the whole dictionary under the current patterns.
+        self.hval = np.zeros(dictionary.dots.shape, dtype=np.int8)
+        self._apply(self.ops)
+        q = np.arange(dictionary.dots.shape[1])
+        n = dictionary.lengths[:, None]
+        # The dots patgen counts: at least left_min letters before and right_min after.
+        self.in_range = (q >= left_min + 1) & (q <= n + 1 - right_min)
+        # (good, bad, missed) after each generated level
+        self.level_counts: List[Tuple[int, int, int]] = []
+
+    def _apply(self, ops: Dict[Tuple[int, ...], Dict[int, int]]):
+        """Raise hval with the values of the given patterns wherever they match"""
+        by_length = {}
+        for codes, pat_ops in ops.items():
+            by_length.setdefault(len(codes), []).append((codes, pat_ops))
+        for length, patterns in by_length.items():
+            if length == 0 or length > self.dictionary.codes.shape[1]:
+                continue
+            codes = np.array([c for c, _ in patterns], dtype=np.uint32)
+            values = np.zeros((len(patterns), length + 1), dtype=np.int8)
+            for p, (_, pat_ops) in enumerate(patterns):
+                for t, v in pat_ops.items():
+                    if v < MAX_VAL:
+                        values[p, t] = v
+            for r, i, p in self._find(codes, _window_hashes(self.dictionary.codes, length)):
+                # Within one length a window matches at most one pattern, so the
+                # (r, i + t) targets are distinct.
+                for t in range(length + 1):
+                    self.hval[r, i + t] = np.maximum(self.hval[r, i + t], values[p, t])
+
+    def _find(self, patterns: np.ndarray, window_hashes: np.ndarray):
+        """Yield (rows, starts, pattern indices) of all occurrences of distinct equal-length patterns"""
+        hashes = _hash_rows(patterns)
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        if len(hashes) > 1 and (np.diff(hashes) == 0).any():
+            # Hash collision between two patterns, look them up one at a time.
+            for p in range(len(patterns)):
+                yield from self._find(patterns[p:p + 1], window_hashes)
+            return
+        idx = np.minimum(np.searchsorted(hashes, window_hashes), len(hashes) - 1)
+        r, i = np.nonzero(hashes[idx] == window_hashes)
+        p = order[idx[r, i]]
+        length = patterns.shape[1]
+        windows = self.dictionary.codes[r[:, None], i[:, None] + np.arange(length)]
+        exact = (windows == patterns[p]).all(axis=1)
+        yield r[exact], i[exact], p[exact]
+
+    def counts(self) -> Tuple[int, int, int]:
+        """(good, bad, missed) of the current patterns on the dictionary, as patgen prints them"""
+        state = self.dictionary.dots + (self.hval & 1)
+        w = self.dictionary.weights * self.in_range
+        return (int((w * (state == FOUND_HYF)).sum()),
+                int((w * (state == ERR_HYF)).sum()),
+                int((w * (state == IS_HYF)).sum()))
+
+    def generate_level(self, hyph_level: int, pat_start: int, pat_finish: int,
+                       good_wt: int, bad_wt: int, thresh: int):
+        # Patterns with a value of at least hyph_level at some dot, keyed by
+        # (length, dot); candidates containing one at the same dot are not counted.
+        self._high: Dict[Tuple[int, int], _CodeSet] = {}
+        for codes, pat_ops in self.ops.items():
+            for t, v in pat_ops.items():
+                if v >= hyph_level:
+                    self._high.setdefault((len(codes), t), _CodeSet()).add(codes)
+
+        more_this_level = [True] * (pat_finish + 2)
+        for pat_len in range(pat_start, pat_finish + 1):
+            if pat_len > self.dictionary.codes.shape[1]:
+                break
+            window_hashes = _window_hashes(self.dictionary.codes, pat_len)
+            for pat_dot in dot_order(pat_len):
+                if more_this_level[pat_dot]:
+                    more_this_level[pat_dot] = self._collect(hyph_level, pat_len, pat_dot, good_wt,
+                                                             bad_wt, thresh, window_hashes)
+            for k in range(len(more_this_level) - 1, 0, -1):
+                if not more_this_level[k - 1]:
+                    more_this_level[k] = False
+        # Hopeless candidates were never added to self.ops, so there is nothing to delete.
+        self._high = {}
+        self.level_counts.append(self.counts())
+
+    def _collect(self, hyph_level, pat_len, pat_dot, good_wt, bad_wt, thresh, window_hashes) -> bool:
+        """One patgen pass; returns whether some candidates were left undecided"""
+        d = self.dictionary
+        q = np.arange(d.dots.shape[1])
+        fits = (q >= pat_dot) & (q - pat_dot + pat_len <= (d.lengths + 2)[:, None])
+        state = d.dots + (self.hval & 1)
+        # Odd levels look for missing hyphens, even levels for wrong ones.
+        good_state, bad_state = (IS_HYF, NO_HYF) if hyph_level % 2 else (ERR_HYF, FOUND_HYF)
+        is_good = state == good_state
+        r, dpos = np.nonzero(self.in_range & fits & (is_good | (state == bad_state)))
+        if not len(r):
+            return False
+        start = dpos - pat_dot
+        keys = window_hashes[r, start]
+        uniq, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+        windows = d.codes[r[:, None], start[:, None] + np.arange(pat_len)]
+        if not (windows == windows[first][inv]).all():
+            # Two different windows share a hash; group them exactly instead.
+            _, first, inv = np.unique(windows, axis=0, return_index=True, return_inverse=True)
+        inv = inv.ravel()
+        wt = d.weights[r, dpos]
+        good = np.bincount(inv, weights=wt * is_good[r, dpos]).astype(np.int64)
+        bad = np.bincount(inv, weights=wt * ~is_good[r, dpos]).astype(np.int64)
+        candidates = windows[first]
+
+        keep = ~self._contains_high(candidates, pat_dot)
+        hopeless = keep & (good_wt * good < thresh)
+        chosen = keep & ~hopeless & (good_wt * good - bad_wt * bad >= thresh)
+        more_to_come = bool((keep & ~hopeless & ~chosen).any())
+
+        high = self._high.setdefault((pat_len, pat_dot), _CodeSet())
+        for row in candidates[hopeless | chosen]:
+            high.add(tuple(int(c) for c in row))
+        for row in candidates[chosen]:
+            self.ops.setdefault(tuple(int(c) for c in row), {})[pat_dot] = hyph_level
+        if chosen.any():
+            for r, i, _ in self._find(candidates[chosen], window_hashes):
+                self.hval[r, i + pat_dot] = np.maximum(self.hval[r, i + pat_dot], hyph_level)
+        return more_to_come
+
+    def _contains_high(self, candidates: np.ndarray, pat_dot: int) -> np.ndarray:
+        """Whether each candidate contains a pattern with a value >= hyph_level at pat_dot"""
+        blocked = np.zeros(len(candidates), dtype=bool)
+        pat_len = candidates.shape[1]
+        for (length, t), codeset in self._high.items():
+            offset = pat_dot - t
+            if offset < 0 or offset + length > pat_len:
+                continue
+            blocked |= codeset.contains(candidates[:, offset:offset + length])
+        return blocked
+
+    def patterns(self) -> List[str]:
+        result = []
+        for codes in sorted(self.ops):
+            pat_ops = self.ops[codes]
+            pattern = ''
+            for t in range(len(codes) + 1):
+                if pat_ops.get(t):
+                    pattern += str(pat_ops[t])
+                if t < len(codes):
+                    pattern += chr(codes[t])
+            result.append(pattern)
+        return result
+
+    def write(self, output_file: str):
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(''.join(p + '\n' for p in self.patterns()))
+
+
+def train(dictionary: Dictionary, translate: Translate, runs: List[LevelParams],
+          patterns: Iterable[str] = ()) -> PatternTrainer:
+    """Generate patterns level by level, like the patgen runs of make-full-pattern.sh"""
+    trainer = PatternTrainer(dictionary.translated(translate), translate.left_min, translate.right_min, patterns)
+    for run in runs:
+        for hyph_level in range(run.hyph_start, run.hyph_finish + 1):
+            trainer.generate_level(hyph_level, run.pat_start, run.pat_finish,
+                                   run.good_wt, run.bad_wt, run.thresh)
+    return trainer
+
+
+def train_patterns(dictionary_file: str, translate_file: str, params_file: str, output_file: str):
+    """In-process equivalent of make-full-pattern.sh; writes the final patterns to output_file"""
+    trainer = train(Dictionary.from_file(dictionary_file), read_translate(translate_file),
+                    read_parameters(params_file))
+    trainer.write(output_file)
+    return trainer
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 5:
+        print("Usage: python pypatgen.py <dictionary_file> <translate_file> <parameters_file> <output_file>")
+        sys.exit(1)
+    trainer = train_patterns(*sys.argv[1:])
+    for level, (good, bad, missed) in enumerate(trainer.level_counts, 1):
+        print(f"level {level}: {good} good, {bad} bad, {missed} missed")
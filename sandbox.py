@@ -0,0 +1,29 @@
+# Private working directories for pipeline evaluations, so that concurrent workers
+# never share intermediate files.  They are created in RAM (/dev/shm) where available.
+
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
+
+SANDBOX_ROOT = os.environ.get('SANDBOX_ROOT') or (
+    '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir())
+# Set to 1 to keep the sandbox of an evaluation that raised, for debugging.
+KEEP_FAILED_SANDBOXES = os.environ.get('KEEP_FAILED_SANDBOXES', '0') == '1'
+
+
+@contextmanager
+def sandbox(prefix: str = 'ipa-patterns-', keep_failed: bool = KEEP_FAILED_SANDBOXES) -> Iterator[str]:
+    """A fresh directory (path ending in '/') that is removed when the block exits"""
+    path = tempfile.mkdtemp(prefix=prefix, dir=SANDBOX_ROOT)
+    try:
+        yield path + os.sep
+    except BaseException:
+        if keep_failed:
+            print(f"Keeping sandbox of failed evaluation: {path}", file=sys.stderr)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+        raise
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,224 @@
+# Surrogate models of the optimization score for PatgenSampler.
+#
+# A surrogate is conditioned on all observations so far with observe(X, y), where
+# every call passes the previous observations as a prefix of X, and predicts a mean
+# and an uncertainty (standard deviation) for candidate parameter sets.
+# conditioned(X, y) returns a copy that also believes the given made-up observations,
+# which is how pending evaluations are accounted for.
+#
+#   gp      GaussianProcessRegressor, O(n^3) refits with hyperparameter optimization,
+#           Cholesky updates in between
+#   forest  ExtraTreesRegressor, the uncertainty being the spread of its trees;
+#           scales to many thousands of observations
+#
+# MultiOutputSurrogate models several targets at once, with one surrogate per column.
+
+import os
+from typing import Union
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+from scipy.linalg import cho_solve, cholesky, solve_triangular
+
+SURROGATES = ('gp', 'forest')
+# The GP hyperparameters are re-optimized every REFIT_EVERY observations, or sooner when the
+# mean log marginal likelihood per observation moves by more than LML_DRIFT from its value
+# after the last optimization; in between, observations are added with Cholesky updates.
+REFIT_EVERY = int(os.getenv('REFIT_EVERY', 10))
+LML_DRIFT = float(os.getenv('LML_DRIFT', 0.5))
+# The forest predicts candidates in chunks of this many rows, each tree's predictions are kept.
+FOREST_PREDICT_CHUNK = 1 << 15
+
+
+class GPSurrogate:
+    def __init__(self, gp: GaussianProcessRegressor = None, n_features: int = 13):
+        if gp is None:
+            kernel = Matern(nu=2.5, length_scale=[1.0] * n_features, length_scale_bounds=(1e-5, 1e10)) + \
+                    WhiteKernel(noise_level=0.1, noise_level_bounds=(1e-4, 1))
+            gp = GaussianProcessRegressor(
+                kernel=kernel,
+                normalize_y=True,
+                random_state=42,
+                #alpha=0.1,
+                n_restarts_optimizer=2
+            )
+        self.gp = gp
+        # Observations the GP is conditioned on, and their number at the last hyperparameter fit
+        self._n_fitted = 0
+        self._n_refit = 0
+        self._refit_lml = 0.0
+        if hasattr(gp, 'L_'):
+            # an already fitted GP, e.g. from a saved state
+            self._n_fitted = self._n_refit = len(gp.X_train_)
+            self._refit_lml = self._mean_lml()
+
+    @property
+    def n_observations(self) -> int:
+        return self._n_fitted
+
+    def observe(self, X: np.ndarray, y: np.ndarray):
+        if self._n_fitted == 0 or len(X) - self._n_refit >= REFIT_EVERY:
+            self._refit(X, y)
+            return
+        if len(X) == self._n_fitted:
+            return
+        if not self._extend_cholesky(X[self._n_fitted:], y[self._n_fitted:]):
+            self._refit(X, y)  # numerically not positive definite any more
+        elif abs(self._mean_lml() - self._refit_lml) > LML_DRIFT:
+            self._refit(X, y)
+
+    def _refit(self, X: np.ndarray, y: np.ndarray):
+        """Full fit, including hyperparameter optimization"""
+        self.gp.fit(X, y)
+        self._n_fitted = self._n_refit = len(X)
+        self._refit_lml = self._mean_lml()
+
+    def _extend_cholesky(self, X_new: np.ndarray, y_new: np.ndarray) -> bool:
+        """Condition the GP on more observations, keeping the kernel hyperparameters and the
+        target normalization of the last fit"""
+        gp = self.gp
+        X_new = np.asarray(X_new, dtype=float)
+        y_new = (np.asarray(y_new) - gp._y_train_mean) / gp._y_train_std
+        # [[L, 0], [B^T, C]] is the Cholesky factor of [[K, K_cross^T], [K_cross, K_new]]
+        # with B = L^-1 K_cross^T and C = chol(K_new - B^T B).
+        K_cross = gp.kernel_(X_new, gp.X_train_)
+        K_new = gp.kernel_(X_new)
+        K_new[np.diag_indices_from(K_new)] += gp.alpha
+        B = solve_triangular(gp.L_, K_cross.T, lower=True, check_finite=False)
+        try:
+            C = cholesky(K_new - B.T @ B, lower=True, check_finite=False)
+        except np.linalg.LinAlgError:
+            return False
+        n, m = gp.L_.shape[0], len(X_new)
+        L = np.zeros((n + m, n + m))
+        L[:n, :n] = gp.L_
+        L[n:, :n] = B.T
+        L[n:, n:] = C
+        gp.L_ = L
+        gp.X_train_ = np.vstack([gp.X_train_, X_new])
+        gp.y_train_ = np.concatenate([gp.y_train_, y_new])
+        gp.alpha_ = cho_solve((L, True), gp.y_train_, check_finite=False)
+        self._n_fitted += m
+        return True
+
+    def _mean_lml(self) -> float:
+        """Log marginal likelihood per observation of the (normalized) data the GP is conditioned on"""
+        gp = self.gp
+        n = len(gp.y_train_)
+        lml = -0.5 * gp.y_train_ @ gp.alpha_ - np.log(np.diag(gp.L_)).sum() - 0.5 * n * np.log(2 * np.pi)
+        return float(lml) / n
+
+    def predict(self, X: np.ndarray, return_std: bool = False):
+        return self.gp.predict(X, return_std=return_std)
+
+    def conditioned(self, X: np.ndarray, y: np.ndarray) -> 'GPSurrogate':
+        # Hyperparameters stay those of the real fit, so this is a single cheap fit.
+        gp = GaussianProcessRegressor(kernel=self.gp.kernel_, normalize_y=True, optimizer=None)
+        gp.fit(np.vstack([self.gp.X_train_, X]),
+               np.concatenate([self.gp.y_train_ * self.gp._y_train_std + self.gp._y_train_mean, y]))
+        return GPSurrogate(gp)
+
+
+class ForestSurrogate:
+    def __init__(self, n_estimators: int = 200, min_samples_leaf: int = 3, n_features: int = 13):
+        self.forest = ExtraTreesRegressor(n_estimators=n_estimators, min_samples_leaf=min_samples_leaf,
+                                          random_state=42, n_jobs=1)
+        self.X = np.zeros((0, n_features))
+        self.y = np.zeros(0)
+
+    @property
+    def n_observations(self) -> int:
+        return len(self.y)
+
+    def observe(self, X: np.ndarray, y: np.ndarray):
+        self.X = np.asarray(X, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.forest.fit(self.X, self.y)
+
+    def predict(self, X: np.ndarray, return_std: bool = False):
+        means, stds = [], []
+        for i in range(0, len(X), FOREST_PREDICT_CHUNK):
+            per_tree = np.array([tree.predict(X[i:i + FOREST_PREDICT_CHUNK]) for tree in self.forest.estimators_])
+            means.append(per_tree.mean(axis=0))
+            stds.append(per_tree.std(axis=0))
+        mean = np.concatenate(means) if means else np.zeros(0)
+        if not return_std:
+            return mean
+        return mean, np.concatenate(stds) if stds else np.zeros(0)
+
+    def conditioned(self, X: np.ndarray, y: np.ndarray) -> 'ForestSurrogate':
+        copy = ForestSurrogate(self.forest.n_estimators, self.forest.min_samples_leaf, self.X.shape[1])
+        copy.observe(np.vstack([self.X, X]), np.concatenate([self.y, y]))
+        return copy
+
+
+class MultiOutputSurrogate:
+    """Independent surrogates of the columns of 2-D targets; predicts (n, n_outputs) means and stds"""
+    def __init__(self, name: str = 'gp', n_features: int = 13, n_outputs: int = 2):
+        self.name = name
+        self.models = [make_surrogate(name, n_features) for _ in range(n_outputs)]
+
+    @property
+    def n_observations(self) -> int:
+        return self.models[0].n_observations
+
+    def observe(self, X: np.ndarray, Y: np.ndarray):
+        for j, model in enumerate(self.models):
+            model.observe(X, Y[:, j])
+
+    def predict(self, X: np.ndarray, return_std: bool = False):
+        predictions = [model.predict(X, return_std=return_std) for model in self.models]
+        if not return_std:
+            return np.column_stack(predictions)
+        return np.column_stack([m for m, _ in predictions]), np.column_stack([sd for _, sd in predictions])
+
+    def conditioned(self, X: np.ndarray, Y: np.ndarray) -> 'MultiOutputSurrogate':
+        copy = MultiOutputSurrogate.__new__(MultiOutputSurrogate)
+        copy.name = self.name
+        copy.models = [model.conditioned(X, Y[:, j]) for j, model in enumerate(self.models)]
+        return copy
+
+
+Surrogate = Union[GPSurrogate, ForestSurrogate, MultiOutputSurrogate]
+
+
+def make_surrogate(name: str, n_features: int = 13) -> Surrogate:
+    if name == 'gp':
+        return GPSurrogate(n_features=n_features)
+    if name == 'forest':
+        return ForestSurrogate(n_features=n_features)
+    raise ValueError(f"unknown surrogate {name}, expected one of {', '.join(SURROGATES)}")
+
+
+def same_kind(a: Surrogate, b: Surrogate) -> bool:
+    """Whether two surrogates are of the same backend and shape, i.e. one can stand in for the other"""
+    if isinstance(a, MultiOutputSurrogate) and isinstance(b, MultiOutputSurrogate):
+        return len(a.models) == len(b.models) and same_kind(a.models[0], b.models[0])
+    return type(a) is type(b)
+
+
+def compare_surrogates(X: np.ndarray, y: np.ndarray, names=SURROGATES, folds: int = 5,
+                       seed: int = 42) -> dict:
+    """Cross-validated (rmse, mean negative log predictive density, fit seconds) of each surrogate"""
+    import time
+    from scipy.stats import norm
+
+    order = np.random.RandomState(seed).permutation(len(y))
+    results = {}
+    for name in names:
+        sq_errors, nlpd, fit_time = [], [], 0.0
+        for fold in range(folds):
+            test = order[fold::folds]
+            train = np.setdiff1d(order, test)
+            surrogate = make_surrogate(name, X.shape[1])
+            start = time.time()
+            surrogate.observe(X[train], y[train])
+            fit_time += time.time() - start
+            mean, std = surrogate.predict(X[test], return_std=True)
+            std = np.maximum(std, 1e-6)
+            sq_errors.append((mean - y[test]) ** 2)
+            nlpd.append(-norm.logpdf(y[test], mean, std))
+        results[name] = (float(np.sqrt(np.concatenate(sq_errors).mean())),
+                         float(np.concatenate(nlpd).mean()), fit_time)
+    return results
@@ -0,0 +1,17 @@
+#!/bin/bash
+# Rewrites the expected patgen output of this fixture, pattern.final and counts (the
+# good, bad and missed that patgen reports after every level).  Needs patgen on PATH.
+#
+# Usage: bash tests/fixtures/patgen/regenerate.sh
+
+set -e
+here=$(cd "$(dirname "$0")" && pwd)
+work=$(mktemp -d)
+trap 'rm -rf "$work"' EXIT
+
+(cd "$work" && bash "$here/../../../make-full-pattern.sh" "$here/words.wlh" "$here/translate" "$here/params.par" > /dev/null)
+cp "$work/pattern.final" "$here/pattern.final"
+levels=$(grep -c '^good_bad_thres' "$here/params.par")
+for i in $(seq 1 "$levels"); do
+  grep -o '[0-9]* good, [0-9]* bad, [0-9]* missed' "$work/pattern.$i.log" | tail -1
+done > "$here/counts"
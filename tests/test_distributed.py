@@ -0,0 +1,169 @@
+# The coordinator/worker queue of optimize_params on localhost: a coordinator, several
+# worker processes with a stub sample(), and one worker killed in the middle of its task,
+# which must be handed out again after HEARTBEAT_TIMEOUT and still be committed once, and
+# one that raises, whose parameters must not be handed out again.
+
+import ast
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import pytest
+import optimize_params as op
+from evaluation_store import params_key
+
+HEARTBEAT_TIMEOUT = 1.0
+N_WORKERS = 3
+
+
+def free_address() -> str:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"127.0.0.1:{s.getsockname()[1]}"
+
+
+def stub_sample(hang_marker):
+    """sample() whose first call in any worker hangs, after writing the worker's pid to hang_marker"""
+    def sample(input_files, weights, params_ipa, params_single, threshold, language, workdir_i=None,
+               fidelity=1.0, stopping=None, timings=None):
+        try:
+            fd = os.open(hang_marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            time.sleep(0.05)
+            if timings is not None:
+                timings['joint'] = 0.05
+            return sum(weights) + 100, threshold, sum(params_ipa) + sum(params_single)
+        os.write(fd, f"{os.getpid()} {workdir_i} {time.time()}".encode())
+        os.close(fd)
+        time.sleep(600)
+    return sample
+
+
+def kill_hanging_worker(hang_marker, killed: dict):
+    """Kill the worker that wrote hang_marker as soon as it appears"""
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with open(hang_marker) as f:
+                pid, task, started = f.read().split()
+        except (OSError, ValueError):
+            time.sleep(0.05)
+            continue
+        os.kill(int(pid), signal.SIGKILL)
+        killed.update(pid=int(pid), task=int(task), started=float(started))
+        return
+
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch):
+    """Patches for fast heartbeats and the stub sample, before the workers are forked"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'work').mkdir()
+    hang_marker = str(tmp_path / 'hanging')
+    monkeypatch.setattr(op, 'sample', stub_sample(hang_marker))
+    monkeypatch.setattr(op, 'corpus_digest', lambda input_files, language: 'stub')
+    monkeypatch.setattr(op, 'HEARTBEAT_SECONDS', 0.1)
+    monkeypatch.setattr(op, 'HEARTBEAT_TIMEOUT', HEARTBEAT_TIMEOUT)
+    monkeypatch.setattr(op, 'WORKER_POLL_SECONDS', 0.1)
+    monkeypatch.setattr(op, 'STOPPING_RULE', 'none')
+    monkeypatch.setattr(op, 'RELATED_LANGUAGES', [])
+    address = free_address()
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=op.run_worker, args=(address, None)) for _ in range(N_WORKERS)]
+    killed = {}
+    killer = threading.Thread(target=kill_hanging_worker, args=(hang_marker, killed), daemon=True)
+    yield address, workers, killer, killed
+    for worker in workers:
+        worker.join(timeout=10)
+        if worker.is_alive():
+            worker.kill()
+
+
+def test_work_queue_reassigns_the_task_of_a_dead_worker(cluster):
+    address, workers, killer, killed = cluster
+    work_queue = op.WorkQueue()
+    server = op.serve_work_queue(work_queue, address, None)
+    n_tasks = 12
+    for task in range(n_tasks):
+        params = ((task % 9, 1, 1, 1), (task % 8 + 1, 2, 2, 2), (3, 3, 3, 3), task % 8 + 1)
+        work_queue.submit(task, ([], *params, 'pl', task))
+    for worker in workers:
+        worker.start()
+    killer.start()
+
+    results = {}
+    try:
+        while len(results) < n_tasks:
+            task, result, timings, worker = work_queue.get_result(timeout=30)
+            assert task not in results
+            results[task] = (result, worker, time.time())
+        work_queue.close()
+        for worker in workers:
+            worker.join(timeout=10)
+        with pytest.raises(queue.Empty):
+            work_queue.get_result(timeout=0.5)
+    finally:
+        server.stop_event.set()
+
+    assert sorted(results) == list(range(n_tasks))
+    _, worker, finished = results[killed['task']]
+    assert not worker.endswith(f":{killed['pid']}")
+    assert finished - killed['started'] >= HEARTBEAT_TIMEOUT
+    assert all(not isinstance(result, BaseException) for result, _, _ in results.values())
+
+
+def test_main_distributed_commits_every_evaluation_once(cluster):
+    address, workers, killer, killed = cluster
+    n_evaluations = 8
+    for worker in workers:
+        worker.start()
+    killer.start()
+    op.main_distributed(total_evaluations=n_evaluations, in_flight=4, address=address, authkey=None)
+
+    assert killed, "no worker was killed"
+    connection = sqlite3.connect(op.EVALUATION_DB)
+    rows = connection.execute('SELECT params, owner, timings FROM evaluations').fetchall()
+    assert len(rows) == n_evaluations
+    assert len({params for params, _, _ in rows}) == n_evaluations
+    assert len({owner for _, owner, _ in rows}) == 1
+    assert all(timings is not None for _, _, timings in rows)
+    state = op.PatgenSampler.load_state('work/modelpl.pkl')
+    assert len(state.X) == n_evaluations
+
+
+def failing_sample(fail_marker):
+    """sample() whose first call in any worker raises, after writing its parameters to fail_marker"""
+    def sample(input_files, weights, params_ipa, params_single, threshold, language, workdir_i=None,
+               fidelity=1.0, stopping=None, timings=None):
+        try:
+            fd = os.open(fail_marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if timings is not None:
+                timings['joint'] = 0.01
+            return sum(weights) + 100, threshold, sum(params_ipa) + sum(params_single)
+        os.write(fd, repr((weights, params_ipa, params_single, threshold)).encode())
+        os.close(fd)
+        raise RuntimeError("patgen failed")
+    return sample
+
+
+def test_main_distributed_does_not_suggest_failed_parameters_again(cluster, tmp_path, monkeypatch):
+    address, workers, _, _ = cluster
+    fail_marker = tmp_path / 'failing'
+    monkeypatch.setattr(op, 'sample', failing_sample(str(fail_marker)))
+    n_evaluations = 8
+    for worker in workers:
+        worker.start()
+    op.main_distributed(total_evaluations=n_evaluations, in_flight=4, address=address, authkey=None)
+
+    failed = ast.literal_eval(fail_marker.read_text())
+    connection = sqlite3.connect(op.EVALUATION_DB)
+    params = [p for p, in connection.execute('SELECT params FROM evaluations')]
+    assert len(params) == n_evaluations - 1
+    assert params_key(*failed) not in params
+    state = op.PatgenSampler.load_state('work/modelpl.pkl')
+    assert state.failed == [state._encode_params(*failed)]
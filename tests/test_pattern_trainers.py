@@ -0,0 +1,77 @@
+# pypatgen against patgen: both trainers on the same small committed dictionaries must
+# produce the same patterns and the same (good, bad, missed) after every level, before
+# PATTERN_TRAINER=python can be trusted in place of make-full-pattern.sh.
+#
+# tests/fixtures/patgen holds patgen's output for a tiny word list whose translate file folds
+# some capitals into lowercase letters and keeps others as letters of their own, so the
+# comparison also runs where patgen is not installed.  Its regenerate.sh rewrites the
+# expected output with patgen, and test_patgen_fixture_is_current checks it whenever patgen
+# is installed.
+
+import os
+import re
+import shutil
+import pytest
+from early_stopping import read_patgen_counts
+from level_cache import LevelCache, make_full_pattern
+from pypatgen import read_parameters, train_patterns
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = [
+    ('groundtruth/pl-wiktionary.wlh', 'translatefiles/pl', 'parameters/csskhyphen.par'),
+    ('groundtruth/uk-wiktionary.wlh', 'translatefiles/uk', 'parameters/csskhyphen.par'),
+]
+FIXTURE = os.path.join(ROOT, 'tests', 'fixtures', 'patgen')
+FIXTURE_INPUTS = tuple(os.path.join(FIXTURE, f) for f in ('words.wlh', 'translate', 'params.par'))
+
+
+def read_patterns(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_fixture_counts():
+    with open(os.path.join(FIXTURE, 'counts'), 'r', encoding='utf-8') as f:
+        return [tuple(map(int, counts)) for counts in re.findall(r'(\d+) good, (\d+) bad, (\d+) missed', f.read())]
+
+
+def run_patgen(tmp_path, dictionary_file, translate_file, params_file):
+    """pattern.final and the counts after every level of make-full-pattern.sh with patgen"""
+    patgen_dir = tmp_path / 'patgen'
+    patgen_dir.mkdir()
+    result = make_full_pattern(dictionary_file, translate_file, params_file, str(patgen_dir),
+                               cache=LevelCache(str(tmp_path / 'cache'), max_bytes=0), capture_output=True)
+    assert result.returncode == 0, result.stderr.decode('utf-8', errors='replace')
+    levels = len(read_parameters(params_file))
+    counts = [read_patgen_counts(str(patgen_dir / f'pattern.{n}.log')) for n in range(1, levels + 1)]
+    return patgen_dir / 'pattern.final', counts
+
+
+def test_python_trainer_matches_patgen_fixture(tmp_path):
+    python_final = tmp_path / 'python.final'
+    trainer = train_patterns(*FIXTURE_INPUTS, str(python_final))
+
+    assert [tuple(counts) for counts in trainer.level_counts] == read_fixture_counts()
+    assert sorted(read_patterns(python_final)) == sorted(read_patterns(os.path.join(FIXTURE, 'pattern.final')))
+
+
+@pytest.mark.skipif(shutil.which('patgen') is None, reason='patgen is not installed')
+def test_patgen_fixture_is_current(tmp_path):
+    patgen_final, patgen_counts = run_patgen(tmp_path, *FIXTURE_INPUTS)
+    assert patgen_counts == read_fixture_counts(), "rerun tests/fixtures/patgen/regenerate.sh"
+    assert sorted(read_patterns(patgen_final)) == sorted(read_patterns(os.path.join(FIXTURE, 'pattern.final')))
+
+
+@pytest.mark.skipif(shutil.which('patgen') is None, reason='patgen is not installed')
+@pytest.mark.parametrize('dictionary_file,translate_file,params_file', CASES)
+def test_python_trainer_matches_patgen(tmp_path, dictionary_file, translate_file, params_file):
+    dictionary_file, translate_file, params_file = (os.path.join(ROOT, f)
+                                                    for f in (dictionary_file, translate_file, params_file))
+    patgen_final, patgen_counts = run_patgen(tmp_path, dictionary_file, translate_file, params_file)
+
+    python_final = tmp_path / 'python.final'
+    trainer = train_patterns(dictionary_file, translate_file, params_file, str(python_final))
+
+    assert [tuple(counts) for counts in trainer.level_counts] == patgen_counts
+    # patgen orders patterns by its internal letter codes, pypatgen by code point; the sets must match.
+    assert sorted(read_patterns(python_final)) == sorted(read_patterns(patgen_final))
@@ -0,0 +1,31 @@
+# main_reproducible_parallel must save the same model, byte for byte, whatever the number of
+# processes: a stub sample() that finishes out of order and draws from the global numpy
+# generator is run with 1, 4 and 7 processes.
+
+import time
+import numpy as np
+import optimize_params as op
+
+
+def stub_sample(input_files, weights, params_ipa, params_single, threshold, language, workdir_i=None,
+                fidelity=1.0, stopping=None, timings=None):
+    # Later slots of a round finish first, and the seeded global generator adds noise.
+    time.sleep(0.002 * (12 - workdir_i) + np.random.rand() * 0.01)
+    noise = np.random.randint(0, 20)
+    score = -sum((np.array(params_ipa) - 4) ** 2) - (threshold - 5) ** 2 - sum(weights) % 3
+    return int(1000 + 10 * score) + noise, int(abs(score) * 3 + 5), 50
+
+
+def test_saved_state_does_not_depend_on_the_number_of_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(op, 'sample', stub_sample)
+    monkeypatch.setattr(op, 'RELATED_LANGUAGES', [])
+    monkeypatch.delenv('TARGET_LANGUAGE', raising=False)
+    saved = {}
+    for n_processes in (1, 4, 7):
+        run_dir = tmp_path / str(n_processes)
+        (run_dir / 'work').mkdir(parents=True)
+        monkeypatch.chdir(run_dir)
+        op.main_reproducible_parallel(n_processes)
+        saved[n_processes] = ((run_dir / 'work' / 'modelpl.pkl').read_bytes(),
+                              (run_dir / 'optimizer_behavior_pl.pkl').read_bytes())
+    assert saved[1] == saved[4] == saved[7]
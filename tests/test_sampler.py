@@ -0,0 +1,30 @@
+# PatgenSampler keeps parameter sets whose evaluation raised out of later suggestions, so the
+# asynchronous and distributed loops do not hand the same failing point out again.
+
+import numpy as np
+import optimize_params as op
+
+
+def fitted_sampler(n_observations=8):
+    sampler = op.PatgenSampler(surrogate='gp', score_model='score', acquisition='ucb')
+    for params, _, _ in sampler.suggest_batch(n_suggestions=n_observations):
+        sampler.update(*params, sum(params[0]) / 40 + params[3] / 20)
+    return sampler
+
+
+def test_failed_parameters_are_not_suggested_again(tmp_path, monkeypatch):
+    sampler = fitted_sampler()
+    X = sampler._random_param_matrix(50)
+    failing = sampler._decode_params(X[0])
+    # The failing parameter set is always the best candidate on offer.
+    values = np.arange(len(X), 0, -1, dtype=float)
+    monkeypatch.setattr(sampler, '_acquisition_candidates', lambda acquisition, n_candidates: (X, values))
+    assert sampler.exploit_best_candidates(n_suggestions=1)[0][0] == failing
+
+    sampler.record_failure(failing)
+    assert failing not in [p for p, _, _ in sampler.exploit_best_candidates(n_suggestions=10)]
+    assert failing not in [p for p, _, _ in sampler.suggest_batch(n_suggestions=10)]
+
+    state = tmp_path / 'model.pkl'
+    sampler.save_state(str(state))
+    assert op.PatgenSampler.load_state(str(state)).failed == sampler.failed
@@ -0,0 +1,63 @@
+# The native validator against patgen's hyphenation pass, as pypatgen reimplements it:
+# patgen maps letters only through the translate file, so capitals that the file keeps as
+# letters of their own must not be matched by lowercase patterns.
+
+import os
+import pytest
+import validate
+from hyph import Hyphenator
+from pypatgen import Dictionary, PatternTrainer, read_parameters, read_translate, train
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UK_TRANSLATE = os.path.join(ROOT, 'translatefiles', 'uk')
+# translatefiles/uk folds И and Т into и and т, but keeps Н and Д as letters of their own.
+WORDS = ['Нас-та-сів', 'Дмит-рів-ка', 'на-ві-га-тор', 'ІН-ТЕР-НАТ', 'И-ТА-ка']
+PATTERNS = ['н1а', 'а1с', 'с1т', '1ті', 'д1м', 'т1р', 'и1т', 'і1в', 'в1к', 'е1р', 'а1т']
+
+
+def patgen_counts(wlh, patterns, translate):
+    """(good, bad, missed) of patgen's hyphenation pass with the given patterns"""
+    dictionary = Dictionary.from_file(wlh).translated(translate)
+    return PatternTrainer(dictionary, translate.left_min, translate.right_min, patterns).counts()
+
+
+@pytest.fixture
+def uk_root(monkeypatch):
+    # validate() finds translatefiles/<lang> relative to the working directory.
+    monkeypatch.chdir(ROOT)
+
+
+def test_capitals_are_matched_through_the_translate_file(tmp_path, uk_root):
+    wlh = tmp_path / 'words.wlh'
+    wlh.write_text(''.join(w + '\n' for w in WORDS), encoding='utf-8')
+    pat = tmp_path / 'words.pat'
+    pat.write_text(''.join(p + '\n' for p in PATTERNS), encoding='utf-8')
+    translate = read_translate(UK_TRANSLATE)
+
+    expected = patgen_counts(str(wlh), PATTERNS, translate)
+    assert validate.validate(str(wlh), str(pat), 'uk') == expected
+    # Lowercasing every word, as the validator used to, gives other counts here.
+    lowered = validate.load_ground_truth(str(wlh)).score(Hyphenator.from_patterns(PATTERNS),
+                                                         translate.left_min, translate.right_min)
+    assert lowered != expected
+
+
+def test_full_ukrainian_ground_truth_matches_patgen(tmp_path, uk_root):
+    # More than half of the words of uk-full-wiktionary.wlh are capitalized.
+    wlh = os.path.join(ROOT, 'groundtruth', 'uk-full-wiktionary.wlh')
+    translate = read_translate(UK_TRANSLATE)
+    trainer = train(Dictionary.from_file(wlh), translate,
+                    read_parameters(os.path.join(ROOT, 'parameters', 'csskhyphen.par')))
+    pat = tmp_path / 'uk.pat'
+    trainer.write(str(pat))
+
+    assert validate.validate(wlh, str(pat), 'uk') == trainer.counts() == trainer.level_counts[-1]
+
+
+def test_characters_missing_from_the_translate_file_are_rejected(tmp_path, uk_root):
+    wlh = tmp_path / 'words.wlh'
+    wlh.write_text('на-ві-га-тор\nQ-ua-ck\n', encoding='utf-8')
+    pat = tmp_path / 'words.pat'
+    pat.write_text('н1а\n', encoding='utf-8')
+    with pytest.raises(ValueError, match="bad characters 'Q'"):
+        validate.validate(str(wlh), str(pat), 'uk')
@@ -2,32 +2,151 @@ import re
 import subprocess
 import os
 import sys
-from typing import Optional, Tuple
-# Directly uses patgen to get data on the validation perf of a given validation wl and a given pattern set.
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from hyph import Hyphenator
+from pypatgen import read_translate
+from sandbox import sandbox
+# Computes the validation perf of a given pattern set on a given validation wl: natively, with
+# the same counts as patgen's hyphenation pass, or directly with patgen.
 
-WORKDIR = '/var/tmp/validate-patterns'
-os.makedirs(WORKDIR, exist_ok=True)
+# Reads the patterns of a pattern.tex file the way patgen gets them after clean_pattern_dot_tex.
+def read_tex_patterns(tex_file: str) -> List[str]:
+    with open(tex_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('%') or line.startswith('}') or line.startswith("\\hyphenation{"):
+            continue
+        if '-' in line:
+            continue
+        if line.startswith('\\patterns{'):
+            line = line[10:]
+        patterns.extend(line.split())
+    return patterns
 
-# Cleans pattern.tex file to be edible by patgen. Sends result to WORKDIR/pat.pat
-def clean_pattern_dot_tex(tex_file: str) -> str:
-    result_filename = os.path.abspath(os.path.join(WORKDIR, 'pat.pat'))
+# Cleans pattern.tex file to be edible by patgen. Sends result to workdir/pat.pat
+def clean_pattern_dot_tex(tex_file: str, workdir: str) -> str:
+    result_filename = os.path.abspath(os.path.join(workdir, 'pat.pat'))
     with open(result_filename, 'w', encoding='utf-8') as outf:
-        with open(tex_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        patterns = []
-        for line in lines:
-            line = line.strip()
-            if line.startswith('%') or line.startswith('}') or line.startswith("\\hyphenation{"):
-                continue
-            if '-' in line:
-                continue
-            if line.startswith('\\patterns{'):
-                line = line[10:]
-            patterns.extend(line.split())
-        for pattern in patterns:
+        for pattern in read_tex_patterns(tex_file):
             outf.write(pattern+'\n')
     return result_filename
 
+# Patterns as patgen reads them: cleaned .tex files, otherwise one pattern per line.
+def read_patterns(pat_file: str) -> List[str]:
+    if pat_file.endswith('.tex'):
+        return read_tex_patterns(pat_file)
+    with open(pat_file, 'r', encoding='utf-8') as f:
+        return f.read().split()
+
+
+class GroundTruth:
+    """Words of a .wlh file with their hyphen positions packed into per-word bitmasks.
+
+    Bit k of a word's mask is set if there is a hyphen after its k-th letter.  As in
+    patgen, a leading digit gives the weight of a word, and a line holding only a
+    digit sets the weight of the words that follow.
+    """
+    def __init__(self, wlh: str):
+        self.words = []
+        weights = []
+        positions = []
+        default_wt = 1
+        with open(wlh, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                wt = default_wt
+                if line[0].isdigit():
+                    wt = int(line[0])
+                    line = line[1:]
+                    if not line:
+                        default_wt = wt
+                        continue
+                pieces = line.split('-')
+                word = ''.join(pieces)
+                k = -1
+                hyphens = []
+                for piece in pieces[:-1]:
+                    k += len(piece)
+                    hyphens.append(k)
+                self.words.append(word)
+                weights.append(wt)
+                positions.append(hyphens)
+
+        self.weights = np.array(weights, dtype=np.int64)
+        self.lengths = np.array([len(w) for w in self.words], dtype=np.int64)
+        width = int(self.lengths.max()) if len(self.words) else 0
+        flags = np.zeros((len(self.words), width), dtype=bool)
+        for row, hyphens in enumerate(positions):
+            flags[row, [k for k in hyphens if 0 <= k < width]] = True
+        self.masks = np.packbits(flags, axis=1, bitorder='little')
+
+    def hyphens(self, rows, width: int) -> np.ndarray:
+        """Hyphen flags of the given words, (len(rows), width) bool"""
+        return np.unpackbits(self.masks[rows], axis=1, count=width, bitorder='little').astype(bool)
+
+    def score(self, hyphenator: Hyphenator, left_min: int, right_min: int,
+              letters: Optional[Dict[str, str]] = None) -> Tuple[int, int, int]:
+        """(good, bad, missed) of the hyphenator's hyphens against this ground truth"""
+        return self.score_many([hyphenator], left_min, right_min, letters)[0]
+
+    def score_many(self, hyphenators: List[Hyphenator], left_min: int, right_min: int,
+                   letters: Optional[Dict[str, str]] = None) -> List[Tuple[int, int, int]]:
+        """(good, bad, missed) for each hyphenator, from a single pass over the words.
+        letters are those of the translate file, which patgen matches the words in."""
+        counts = np.zeros((len(hyphenators), 3), dtype=np.int64)
+        blocks = zip(*(h.hyphen_matrix(self.words, left_min, right_min, letters) for h in hyphenators),
+                     strict=True)
+        for block in blocks:
+            truth = None
+            for i, (rows, predicted) in enumerate(block):
+                width = predicted.shape[1]
+                # All hyphenators group the words the same way, so the truth of a
+                # block is normally computed once.
+                if truth is None or truth.shape[1] != width or not np.array_equal(truth_rows, rows):
+                    truth_rows = rows
+                    truth = self.hyphens(rows, width)
+                    k = np.arange(width)
+                    # Only the positions patgen looks at, i.e. those allowed by the hyphen mins.
+                    truth &= (k >= left_min - 1) & (k < (self.lengths[rows] - right_min)[:, None])
+                    wt = self.weights[rows]
+                counts[i] += [wt @ (predicted & truth).sum(axis=1),
+                              wt @ (predicted & ~truth).sum(axis=1),
+                              wt @ (~predicted & truth).sum(axis=1)]
+        return [tuple(int(c) for c in row) for row in counts]
+
+
+# Ground truth indexes by (filename, mtime), loaded once per process.
+_ground_truths = {}
+
+def load_ground_truth(wlh: str) -> GroundTruth:
+    key = (os.path.abspath(wlh), os.path.getmtime(wlh))
+    if key not in _ground_truths:
+        _ground_truths[key] = GroundTruth(wlh)
+    return _ground_truths[key]
+
+# Same counts as validate_using_patgen, without running patgen or writing any files.
+def validate(wlh, pat, lang) -> Tuple[int, int, int]:
+    return validate_many(wlh, [pat], lang)[0]
+
+# Scores several pattern sets (files or already built Hyphenators) against one ground truth,
+# which is read and scanned once for all of them.
+def validate_many(wlh, pats: List[Union[str, Hyphenator]], lang) -> List[Tuple[int, int, int]]:
+    if lang != 'uk' and lang != 'pl':
+        print('lang must be uk or pl')
+        exit(1)
+    # As in patgen, capitals are only folded where the translate file lists them as another
+    # representation of a letter.
+    translate = read_translate(os.path.join("translatefiles", lang))
+    hyphenators = [p if isinstance(p, Hyphenator) else Hyphenator.from_patterns(read_patterns(p))
+                   for p in pats]
+    return load_ground_truth(wlh).score_many(hyphenators, translate.left_min, translate.right_min,
+                                             translate.letters)
+
 # expects both wlh and pat to be in UTF-8
 def validate_using_patgen(wlh, pat, lang) -> Tuple[int, int, int]:
     if lang != 'uk' and lang != 'pl':
@@ -37,26 +156,27 @@ def validate_using_patgen(wlh, pat, lang) -> Tuple[int, int, int]:
     current_dir = os.getcwd()
     wlh = os.path.abspath(os.path.join(current_dir, wlh))
     pat = os.path.abspath(os.path.join(current_dir, pat))
-    if pat.endswith('.tex'):
-        pat = clean_pattern_dot_tex(pat)
     translatefile = os.path.abspath(os.path.join(current_dir, "translatefiles/"+lang))
     # Prepare the input for patgen
     patgen_input = "1 1\n1 9\n1 1 10000\ny\n"
 
-    # Run patgen command
-    process = subprocess.Popen(
-        ['patgen', wlh, pat, '/dev/null', translatefile],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        cwd=WORKDIR,
-        #check=True
-    )
+    # Run patgen command in a private directory, it writes pattmp.1 there
+    with sandbox('validate-') as workdir:
+        if pat.endswith('.tex'):
+            pat = clean_pattern_dot_tex(pat, workdir)
+        process = subprocess.Popen(
+            ['patgen', wlh, pat, '/dev/null', translatefile],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            cwd=workdir,
+            #check=True
+        )
 
-    stdout, stderr = process.communicate(input=patgen_input)
+        stdout, stderr = process.communicate(input=patgen_input)
 
-    print(stderr, sys.stderr)
+    print(stderr, file=sys.stderr)
 
     # Extract counts using a more precise method
     pattern = r'(\d+) good, (\d+) bad, (\d+) missed'
@@ -65,7 +185,7 @@ def validate_using_patgen(wlh, pat, lang) -> Tuple[int, int, int]:
     if match:
         return tuple(map(int, match.groups())) # type: ignore
     else:
-        print(stdout, sys.stderr)
+        print(stdout, file=sys.stderr)
         raise Exception(f"Failed to extract counts from patgen output. wlh: {wlh}, pat: {pat}, translatefile: {translatefile}")
 
 
@@ -74,15 +194,19 @@ def validate_using_patgen(wlh, pat, lang) -> Tuple[int, int, int]:
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
 
-    if len(sys.argv) != 4:
-        print("Usage: python validate.py <wlh_file> <pat_file> <lang>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Count good, bad and missed hyphens of pattern sets on a validation wordlist.")
+    parser.add_argument('wlh_file')
+    parser.add_argument('pat_files', nargs='+', metavar='pat_file')
+    parser.add_argument('lang', choices=['uk', 'pl'])
+    parser.add_argument('--patgen', action='store_true', help="count with patgen instead of natively")
+    args = parser.parse_args()
 
-    wlh_file = sys.argv[1]
-    pat_file = sys.argv[2]
-    lang = sys.argv[3]
-
-    good, bad, missed = validate_using_patgen(wlh_file, pat_file, lang)
-    print(f"{good} good, {bad} bad, {missed} missed")
+    if args.patgen:
+        results = [validate_using_patgen(args.wlh_file, p, args.lang) for p in args.pat_files]
+    else:
+        results = validate_many(args.wlh_file, args.pat_files, args.lang)
+    for pat_file, (good, bad, missed) in zip(args.pat_files, results):
+        prefix = f"{pat_file}: " if len(args.pat_files) > 1 else ""
+        print(f"{prefix}{good} good, {bad} bad, {missed} missed")